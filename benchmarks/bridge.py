@@ -0,0 +1,185 @@
+"""End to end benchmark of the JS <-> python bridge on a real Webview under a private Xvfb.
+
+Measures JS -> python -> JS RPC latency percentiles, calls per second, emit_event throughput,
+evaluate() latency, page load to capabilities ready time and RSS growth over a soak run, then
+prints the results as JSON. Run from the repository root:
+
+    python -m benchmarks.bridge --output bench_output.json
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+from benchmarks.common import xvfb, percentiles
+
+PAGE = """
+<!DOCTYPE HTML>
+<html>
+<body>
+<script>
+    const bench = window.capabilities.bench;
+    bench.ready(performance.now());
+
+    async function rpcLatency(n) {
+        const samples = [];
+        for (let i = 0; i < n; i++) {
+            const start = performance.now();
+            await bench.echo(i);
+            samples.push(performance.now() - start);
+        }
+        return samples;
+    }
+
+    async function rpcThroughput(n) {
+        const start = performance.now();
+        await Promise.all(Array.from({ length: n }, (_, i) => bench.echo(i)));
+        return n / ((performance.now() - start) / 1000);
+    }
+
+    function eventThroughput(n) {
+        return new Promise(resolve => {
+            let received = 0, start = 0;
+            bench.addEventListener("tick", () => {
+                if (received++ === 0) start = performance.now();
+                if (received === n) resolve(n / ((performance.now() - start) / 1000));
+            });
+            bench.emitBurst(n);
+        });
+    }
+
+    async function soak(ms) {
+        const payload = { values: Array.from({ length: 64 }, (_, i) => i), text: "x".repeat(256) };
+        const end = performance.now() + ms;
+        let calls = 0;
+        while (performance.now() < end) {
+            await bench.echo(payload);
+            calls++;
+        }
+        return calls;
+    }
+
+    window.runBench = async (cfg) => {
+        bench.report("rpc_latency_ms", await rpcLatency(cfg.calls));
+        bench.report("rpc_calls_per_s", await rpcThroughput(cfg.calls));
+        bench.report("events_per_s", await eventThroughput(cfg.events));
+    };
+    window.runSoak = async (ms) => bench.report("soak_calls", await soak(ms));
+</script>
+</body>
+</html>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", default=2000, type=int, help="RPC calls for latency and throughput")
+    parser.add_argument("--events", default=5000, type=int, help="Events emitted in one burst")
+    parser.add_argument("--evaluates", default=1000, type=int, help="Sequential evaluate() calls")
+    parser.add_argument("--soak", default=60, type=float, help="Seconds of continuous calls for the RSS measurement")
+    parser.add_argument("--timeout", default=300, type=float, help="Give up on a phase after this many seconds")
+    parser.add_argument("--display", default=":98")
+    parser.add_argument("--output", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    with xvfb(args.display):
+        os.environ["DISPLAY"] = args.display
+        results = run(args)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+def run(args):
+    # Imported once the display exists
+    from src.tinyws import Webview, aio
+    from src.tinyws.capabilities import export
+    from src.tinyws.capabilities.events import EventCapability
+    from src.tinyws.profiles import measure_rss
+
+    class BenchCapability(EventCapability):
+        @staticmethod
+        def name() -> str:
+            return "bench"
+
+        def __init__(self):
+            super().__init__()
+            self.reports = {}
+
+        def report_future(self, name):
+            if name not in self.reports:
+                self.reports[name] = aio.get_loop().create_future()
+            return self.reports[name]
+
+        @export
+        def echo(self, _, v):
+            return v
+
+        @export
+        def ready(self, _, page_ms):
+            self.report_future("ready").set_result((time.perf_counter(), page_ms))
+
+        @export
+        def report(self, _, name, data):
+            self.report_future(name).set_result(data)
+
+        @export
+        def emitBurst(self, _, n):
+            for i in range(n):
+                self.emit_event(self.wv, "tick", {"i": i})
+
+    bench = BenchCapability()
+    results = {}
+    started = time.perf_counter()
+    wv = Webview(html=PAGE, capabilities=[bench], forward_console=False, width=400, height=300)
+
+    async def wait(name):
+        return await asyncio.wait_for(bench.report_future(name), args.timeout)
+
+    async def measure():
+        try:
+            ready_at, page_ms = await wait("ready")
+            results["capabilities_ready_ms"] = (ready_at - started) * 1000
+            results["capabilities_ready_page_ms"] = page_ms
+
+            samples = []
+            for _ in range(args.evaluates):
+                start = time.perf_counter()
+                await wv.evaluate("1")
+                samples.append((time.perf_counter() - start) * 1000)
+            results["evaluate_latency_ms"] = percentiles(samples)
+
+            wv.evaluate(f"runBench({json.dumps({'calls': args.calls, 'events': args.events})})")
+            results["rpc_latency_ms"] = percentiles(await wait("rpc_latency_ms"))
+            results["rpc_calls_per_s"] = await wait("rpc_calls_per_s")
+            results["events_per_s"] = await wait("events_per_s")
+
+            rss_start = measure_rss()
+            wv.evaluate(f"runSoak({int(args.soak * 1000)})")
+            soak_calls = await wait("soak_calls")
+            rss_end = measure_rss()
+            results["soak"] = {
+                "seconds": args.soak,
+                "calls": soak_calls,
+                "rss_start": rss_start,
+                "rss_end": rss_end,
+                "rss_growth": rss_end - rss_start,
+            }
+            results["responses"] = dict(wv.responses.stats)
+            results["eval_stats"] = dict(wv.eval_stats)
+        except asyncio.TimeoutError:
+            results["error"] = f"Timed out after {args.timeout}s, partial results only"
+        finally:
+            wv.__cleanup__()
+
+    aio.ensure_future(measure())
+    wv.run()
+    return results
+
+
+if __name__ == "__main__":
+    main()
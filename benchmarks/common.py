@@ -0,0 +1,34 @@
+import os
+import sys
+import time
+import subprocess
+from contextlib import contextmanager
+
+
+@contextmanager
+def xvfb(display):
+    """Runs a private Xvfb on `display` for the duration of the block"""
+    proc = subprocess.Popen(["Xvfb", display, "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket = f"/tmp/.X11-unix/X{display.lstrip(':')}"
+    for _ in range(100):
+        if os.path.exists(socket):
+            break
+        time.sleep(0.05)
+    else:
+        proc.kill()
+        sys.exit(f"Xvfb did not start on {display}")
+    try:
+        yield
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = {f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+    result["max"] = ordered[-1]
+    return result
@@ -0,0 +1,48 @@
+"""Microbenchmark of JavaScriptCore.Value -> python conversion, the old to_json/json.loads
+round trip against jsv_to_primitive, over typical RPC payload sizes. Run from the repository root:
+
+    python -m benchmarks.jsv_convert
+"""
+import json
+import timeit
+import argparse
+
+from src.tinyws import JavaScriptCore
+from src.tinyws.jsvalue import jsv_to_primitive
+
+PAYLOADS = {
+    "call_no_args": "({method: 'get_cpu_usage', args: [], callbackId: 12})",
+    "call_small_args": "({method: 'sayHello', args: ['Javascript!', 42, true], callbackId: 13})",
+    "call_object_arg": "({method: 'setConfig', args: [{theme: 'dark', size: [300, 200], opacity: 0.8, tags: ['a', 'b']}], callbackId: 14})",
+    "result_100_numbers": "Array.from({length: 100}, (_, i) => i * 1.5)",
+    "result_10k_numbers": "Array.from({length: 10000}, (_, i) => i * 1.5)",
+    "result_rows": "Array.from({length: 200}, (_, i) => ({pid: i, name: 'proc' + i, cpu: i / 3, rss: i * 4096}))",
+    "typed_array_64k": "new Float64Array(65536)",
+}
+
+
+def old_jsv_to_primitive(v):
+    if v.is_undefined() or v.is_null():
+        return None
+    return json.loads(v.to_json(0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", default=2000, type=int, help="Conversions per measurement")
+    args = parser.parse_args()
+
+    ctx = JavaScriptCore.Context()
+    results = {}
+    for name, source in PAYLOADS.items():
+        value = ctx.evaluate(source, -1)
+        number = max(1, args.number // 100) if "10k" in name or "64k" in name else args.number
+        old = min(timeit.repeat(lambda: old_jsv_to_primitive(value), number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: jsv_to_primitive(value), number=number, repeat=5)) / number
+        results[name] = {"old_us": old * 1e6, "new_us": new * 1e6, "speedup": old / new}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
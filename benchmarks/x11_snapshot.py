@@ -0,0 +1,112 @@
+"""Compares the X11 window tree snapshot against the old one-request-per-property walk.
+
+Starts its own Xvfb with a few hundred windows and counts how often the client had to block
+on a reply (round trips) next to the wall time. Run from the repository root:
+
+    python -m benchmarks.x11_snapshot --windows 300
+"""
+import os
+import json
+import time
+import argparse
+import statistics
+
+import Xlib.display
+import Xlib.error
+from Xlib.protocol import rq
+
+from benchmarks.common import xvfb
+
+
+class RoundTrips:
+    """Counts the replies the client actually had to wait for"""
+
+    def __init__(self):
+        self.count = 0
+        self._reply = rq.ReplyRequest.reply
+
+    def __enter__(self):
+        counter, reply = self, self._reply
+
+        def counting_reply(req):
+            if req._data is None and req._error is None:
+                counter.count += 1
+            return reply(req)
+
+        rq.ReplyRequest.reply = counting_reply
+        return self
+
+    def __exit__(self, *_):
+        rq.ReplyRequest.reply = self._reply
+
+
+def create_windows(display, count, workspaces=4):
+    root = display.screen().root
+    net_wm_desktop = display.intern_atom("_NET_WM_DESKTOP")
+    cardinal = display.intern_atom("CARDINAL")
+    windows = []
+    for i in range(count):
+        w = root.create_window(0, 0, 10, 10, 0, display.screen().root_depth)
+        w.set_wm_name(f"window {i}")
+        w.change_property(net_wm_desktop, cardinal, 32, [i % workspaces])
+        windows.append(w)
+    display.sync()
+    return windows
+
+
+def naive_tree(display, root):
+    # The walk the capability used to do: intern + get_full_property + get_wm_name per window
+    tree = {}
+    for child in root.query_tree().children:
+        try:
+            workspace = child.get_full_property(display.intern_atom("_NET_WM_DESKTOP"), 0)
+            workspace = f"Workspace {workspace.value[0] + 1}" if workspace else "Unknown Workspace"
+            name = child.get_wm_name()
+            names = tree.setdefault(workspace, [])
+            if name:
+                names.append(name)
+        except Xlib.error.BadWindow:
+            continue
+    return tree
+
+
+def measure(fn, repeat):
+    times, trips = [], []
+    for _ in range(repeat):
+        with RoundTrips() as counter:
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        trips.append(counter.count)
+    return {"median_ms": statistics.median(times) * 1000, "min_ms": min(times) * 1000, "round_trips": max(trips)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--windows", default=300, type=int)
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument("--display", default=":99")
+    args = parser.parse_args()
+
+    with xvfb(args.display):
+        os.environ["DISPLAY"] = args.display
+        from src.tinyws.capabilities.x11windowtree import X11WindowTreeCapability
+
+        creator = Xlib.display.Display(args.display)
+        create_windows(creator, args.windows)
+
+        cap = X11WindowTreeCapability()
+        cap.update_tree()
+        results = {
+            "windows": args.windows,
+            "same_tree": cap.tree == naive_tree(cap.display, cap.root),
+            "naive": measure(lambda: naive_tree(cap.display, cap.root), args.repeat),
+            "snapshot": measure(cap.update_tree, args.repeat),
+        }
+        creator.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import argparse
 from src.tinyws import Webview, Gtk, Gdk  # Assuming the provided code is in a file named webview.py
+from src.tinyws.profiling import Profiler
 # from gi.repository import Gdk, Gtk
 
 def main():
@@ -17,6 +18,9 @@ def main():
     parser.add_argument("--persistent", nargs=2, metavar=('SESSION_FILE', 'COOKIE_FILE'), help="Enable persistent storage")
     parser.add_argument("--css", help="Custom CSS for the window")
     parser.add_argument("--window-type", default="DIALOG", choices=["NORMAL", "DIALOG", "DOCK", "DESKTOP", "POPUP", "TOOLBAR", "MENU", "UTILITY", "SPLASHSCREEN", "DROPDOWN_MENU", "TOOLTIP"], help="Window type")
+    parser.add_argument("--metrics-socket", help="Serve prometheus metrics on this unix socket")
+    parser.add_argument("--profiling", metavar="DIR", help="Profile capability calls, evaluate() and onload hooks, written to DIR on exit")
+    parser.add_argument("--profiling-memory", action="store_true", help="Also track allocations with tracemalloc (slow)")
     parser.add_argument("--window-position", default="CENTER", choices=["CENTER", "MOUSE", "CENTER_ALWAYS", "CENTER_ON_PARENT"], help="Window position")
 
     args = parser.parse_args()
@@ -38,7 +42,9 @@ def main():
         persistent=args.persistent,
         window_css=args.css or "",
         window_type=window_type,
-        position=window_position
+        position=window_position,
+        metrics_socket=args.metrics_socket,
+        profiling=Profiler(args.profiling, memory=args.profiling_memory) if args.profiling else None
     )
 
     webview.run()
@@ -7,6 +7,7 @@ wv = Webview(
     decorated=False,
     transparent=True,
     capabilities=[HelloCapability()],
+    assets={"examples": str(script_dir / "assets")},
     forward_console=True,
     inspect=True,
     html=f"""
@@ -31,7 +32,7 @@ wv = Webview(
 </head>
 <body>
 
-    <img src="file://{script_dir}/assets/emma.webp" />
+    <img src="tinyws-asset://examples/emma.webp" />
     <h1 style="font-size: 5em;">Hello World!</h1>
 
     <script defer>
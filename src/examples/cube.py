@@ -2,7 +2,7 @@ from ..tinyws import Webview
 import pathlib
 
 script_dir = pathlib.Path(__file__).parent.resolve()
-wv = Webview(inspect=True, decorated=False, transparent=True, width='512', height='512', html=f"""
+wv = Webview(inspect=True, decorated=False, transparent=True, width='512', height='512', assets={"examples": str(script_dir / "assets")}, html=f"""
 
 <!DOCTYPE HTML>
 <html>
@@ -30,7 +30,7 @@ wv = Webview(inspect=True, decorated=False, transparent=True, width='512', heigh
 <body>
 
 <div style="margin: 0 4em;" id="content">
-    <img style="max-width: 80vw;" src="file://{script_dir}/assets/wall-gtk4.svg" />
+    <img style="max-width: 80vw;" src="tinyws-asset://examples/wall-gtk4.svg" />
     <h1 style="white-space: nowrap;">TinyWS: Hello World 🍜 </h1>
 </div>
 
@@ -2,7 +2,7 @@ from ..tinyws import Webview
 import pathlib
 
 script_dir = pathlib.Path(__file__).parent.resolve()
-wv = Webview(decorated=False, transparent=True,
+wv = Webview(decorated=False, transparent=True, assets={"hello": str(script_dir / "assets")},
 html=f"""
 
 <!DOCTYPE HTML>
@@ -25,7 +25,7 @@ html=f"""
 </head>
 <body>
 
-    <img src="file://{script_dir}/assets/emma.webp" />
+    <img src="tinyws-asset://hello/emma.webp" />
     <h1 style="font-size: 5em;">Hello World!</h1>
 
 </body>
@@ -0,0 +1,39 @@
+from ..tinyws import Webview
+from ..tinyws.capabilities.sysinfo import SystemInfoCapability
+
+# Several widgets in one process: one WebContext, one capability instance, one main loop
+sysinfo = SystemInfoCapability()
+
+widgets = [
+    Webview(
+        title=f"Widget {i}",
+        shared_context=True,
+        capabilities=[sysinfo],
+        decorated=False,
+        transparent=True,
+        width=300,
+        height=100,
+        x=20,
+        y=20 + i * 120,
+        html=f"""
+<!DOCTYPE HTML>
+<html>
+<body style="color: #f0f0f0; font-family: system-ui; font-size: 2em;">
+<span id="value"></span>
+<script>
+    setInterval(async () => {{
+        const v = "{metric}" === "cpu"
+            ? (await window.capabilities.systemInfo.get_cpu_usage()).reduce((a, b) => a + b) / navigator.hardwareConcurrency
+            : (await window.capabilities.systemInfo.get_memory_info()).percent
+        document.querySelector("#value").textContent = `{metric} ${{v.toFixed(1)}}%`
+    }}, 1000)
+</script>
+</body>
+</html>
+""",
+    )
+    for i, metric in enumerate(("cpu", "memory"))
+]
+
+# Drives every Webview created above
+widgets[0].run()
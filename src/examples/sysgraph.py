@@ -1,6 +1,4 @@
 from ..tinyws import Webview
-from ..tinyws.capabilities.sysinfo import SystemInfoCapability
-from ..tinyws.capabilities import HelloCapability
 
 def generate_html():
     with open(__file__.rsplit('/', 1)[0] + '/sysgraph.html') as f:
@@ -8,7 +6,8 @@ def generate_html():
 
 def main():
     # Create the Webview and load HTML
-    capabilities = [SystemInfoCapability(), HelloCapability()]
+    # By name, psutil is only imported once the page asks for the first sample
+    capabilities = ["systemInfo", "hello"]
     webview = Webview(title="System Monitor", html=generate_html(), capabilities=capabilities, inspect=True)
     
     # Start the GTK main loop
@@ -1,22 +1,20 @@
 import gi
 import collections.abc
 from .utils.logger import warn, error, info, exception
-from json import loads as json_loads
-from asyncio import Future
 
 gi.require_version("Gtk", "3.0")
 gi.require_version("WebKit2", "4.0")
 
 from gi.repository import Gtk, WebKit2, Gio, GLib, Gdk, JavaScriptCore  # type: ignore # noqa: E402
+from . import aio  # noqa: E402
+from .jsvalue import jsv_to_primitive  # noqa: E402
+from .binary import BlobStore, SCHEME as BLOB_SCHEME  # noqa: E402
+from .profiles import Profile, get_profile  # noqa: E402
+from .encoders import get_encoder  # noqa: E402
+from .metrics import metrics, message_size  # noqa: E402
+from .profiling import get_profiler, hook_name  # noqa: E402
+from .assets import assets as asset_server, SCHEME as ASSET_SCHEME  # noqa: E402
 
-def jsv_to_primitive(v: JavaScriptCore.Value):
-    if v.is_undefined() or v.is_null():
-        return None
-    if v.is_function():
-        return lambda *args: jsv_to_primitive(v.function_call(*(JavaScriptCore.Value.new_from_json(arg) for arg in args)))
-    else:
-        return json_loads(v.to_json(0))
-    
 def NOP(*args):
     pass
 
@@ -27,81 +25,198 @@ class Webview:
     webucm: WebKit2.UserContentManager
     webcfg: WebKit2.Settings
 
+    LOAD_STARTED = 0
     LOAD_FINISHED = 3
 
     _store_session: str = ""
-    _evaluate_list = {}
-    _onload_listeners = []
-    _eval_cnt = 0
-    _capabilities = []
-    _js_code_map = {}  # New attribute to store JavaScript code with eval ID
+    _onload_listeners: list
+    _capabilities: list
+    responses = None  # Created by the capabilities on the first reply
+    flush_replies_on_frame = False  # Send replies right before a frame is drawn instead of when idle
+
+    # Process wide, shared by every Webview driven by the same main loop
+    _shared_contexts = {}  # (ephemeral, profile name) -> WebKit2.WebContext
+    _blob_stores = {}  # WebKit2.WebContext -> BlobStore
+    _asset_contexts = set()  # WebKit2.WebContexts serving tinyws-asset://
+    _open = set()
+    _welcomed = False
+
+    # Named user content, so it can be replaced or removed without a reload, see set_stylesheet()
+    _stylesheets: dict
+    _scripts: dict
+
+    # Per instance evaluate() bookkeeping, see __init__
+    _evaluate_list: dict  # eval_id -> [callback, future, deadline]
+    _js_code_map: collections.deque  # (eval_id, source) of the most recent evaluations, for debugging
+    _eval_cnt: int
+    _eval_timeout: float
+    _eval_sweeper = None
+    eval_stats: dict
+    profiler = None  # tinyws.profiling.Profiler, when constructed with profiling=
+    snapshotter = None  # tinyws.snapshot.Snapshotter, when constructed with snapshot=True
+
+    def _profiled(self, key, fn, *args):
+        if self.profiler is None:
+            return fn(*args)
+        return self.profiler.call(key, fn, *args)
+
+    def _eval_source(self, eval_id):
+        for k, js in self._js_code_map:
+            if k == eval_id:
+                return js
+        return "Unknown JavaScript Code"
 
     def __on_evaluate_result__(self, value):
         eval_id = value.object_get_property_at_index(0).to_int32()
-        js_code = self._js_code_map.get(eval_id, "Unknown JavaScript Code")
         result = jsv_to_primitive(value.object_get_property_at_index(1))
-        
-        if eval_id in self._evaluate_list:
-            self._evaluate_list[eval_id](result)
-            del self._evaluate_list[eval_id]
+
+        pending = self._evaluate_list.pop(eval_id, None)
+        if pending:
+            pending[0](result)
         else:
-            error(f"Evaluation ID {eval_id} not found in _evaluate_list.")
+            # Timed out, or the page navigated away before it came back
+            warn("Evaluation ID %d is no longer pending, dropping its result", eval_id)
+
+    def __on_evaluate_failed__(self, eval_id, err):
+        self.eval_stats["failed"] += 1
+        pending = self._evaluate_list.pop(eval_id, None)
+        if pending:
+            pending[1].cancel()
+        error(f"JavaScript code that failed: {self._eval_source(eval_id)}")
 
-    def __on_evaluate__(self, obj, result, _):
+    def __on_evaluate__(self, obj, result, eval_id):
         try:
             value = self.webview.evaluate_javascript_finish(result)
         except Exception as err:
             error(f"Error during JavaScript evaluation: {err}")
-            # Fetch and log the JS code for debugging
-            js_code = self._js_code_map.get(self._eval_cnt - 1, "Unknown JavaScript Code")
-            error(f"JavaScript code that failed: {js_code}")
+            self.__on_evaluate_failed__(eval_id, err)
             return
-        self.__on_evaluate_result__(value)
+        self._profiled("webview.evaluate.result", self.__on_evaluate_result__, value)
 
-    def __on_run_javascript__(self, obj, result, _):
+    def __on_run_javascript__(self, obj, result, eval_id):
         try:
             js_value = self.webview.run_javascript_finish(result)
             if js_value:
                 value = js_value.get_js_value()
-                self.__on_evaluate_result__(value)
+                self._profiled("webview.evaluate.result", self.__on_evaluate_result__, value)
         except Exception as err:
             exception(f"Error during JavaScript run: {err}")
-            # Fetch and log the JS code for debugging
-            js_code = self._js_code_map.get(self._eval_cnt - 1, "Unknown JavaScript Code")
-            exception(f"JavaScript code that failed: {js_code}")
+            self.__on_evaluate_failed__(eval_id, err)
             return
 
-    def apply_stylesheet(self, css=""):
+    def _drop_pending(self, expired_only=False):
+        now = GLib.get_monotonic_time() / 1e6
+        for eval_id, (_, fut, deadline) in list(self._evaluate_list.items()):
+            if expired_only and deadline > now:
+                continue
+            del self._evaluate_list[eval_id]
+            fut.cancel()
+            self.eval_stats["timed_out" if expired_only else "evicted"] += 1
+
+    def _sweep_evaluations(self):
+        self._drop_pending(expired_only=True)
+        if self._evaluate_list:
+            return GLib.SOURCE_CONTINUE
+        self._eval_sweeper = None
+        return GLib.SOURCE_REMOVE
+
+    def apply_stylesheet(self, css="", name=None):
+        """Adds a user stylesheet, giving it a `name` replaces the sheet of the same name instead"""
         if css == "":
             warn("apply_stylesheet() called with no source code")
             return
-        self.webucm.add_style_sheet(WebKit2.UserStyleSheet(css, 0, 0, None, None))
+        if name is None:
+            n = len(self._stylesheets)
+            while f"anonymous-{n}" in self._stylesheets:
+                n += 1
+            name = f"anonymous-{n}"
+        self.set_stylesheet(name, css)
+
+    def set_stylesheet(self, name, css, frames=WebKit2.UserContentInjectedFrames.ALL_FRAMES):
+        """Adds or replaces the named user stylesheet, the current page restyles without a reload.
+        Only that sheet is swapped, e.g. `set_stylesheet("theme", dark_css)` switches themes"""
+        current = self._stylesheets.get(name)
+        if current is not None and current[0] == css:
+            return
+        sheet = WebKit2.UserStyleSheet(css, frames, WebKit2.UserStyleLevel.USER, None, None)
+        self._swap(self._stylesheets, name, (css, sheet))
+
+    def remove_stylesheet(self, name):
+        if name in self._stylesheets:
+            self._swap(self._stylesheets, name, None)
+
+    def set_script(self, name, js, injection_time=WebKit2.UserScriptInjectionTime.END,
+                   frames=WebKit2.UserContentInjectedFrames.TOP_FRAME):
+        """Adds or replaces the named user script, which runs on every following page load"""
+        current = self._scripts.get(name)
+        if current is not None and current[0] == js:
+            return
+        script = WebKit2.UserScript(js, frames, injection_time, None, None)
+        self._swap(self._scripts, name, (js, script))
+
+    def remove_script(self, name):
+        if name in self._scripts:
+            self._swap(self._scripts, name, None)
+
+    def _swap(self, registry, name, entry):
+        is_style = registry is self._stylesheets
+        add = self.webucm.add_style_sheet if is_style else self.webucm.add_script
+        old = registry.get(name)
+        if old is None:
+            registry[name] = entry
+            add(entry[1])
+            return
+        # A replaced entry keeps its place, later sheets win on equal specificity and scripts run in order
+        names = list(registry)
+        following = names[names.index(name) + 1:]
+        if entry is None:
+            del registry[name]
+        else:
+            registry[name] = entry
+        remove = getattr(self.webucm, "remove_style_sheet" if is_style else "remove_script", None)
+        if remove is not None:
+            # The ones after it are taken out and added back behind it
+            remove(old[1])
+            for n in following:
+                remove(registry[n][1])
+            readd = ([name] if entry is not None else []) + following
+        else:
+            # Before WebKit2GTK 2.32 everything has to go and is added back in order
+            (self.webucm.remove_all_style_sheets if is_style else self.webucm.remove_all_scripts)()
+            readd = list(registry)
+        for n in readd:
+            add(registry[n][1])
 
-    def __evaluate__(self, js, cb=True):
+    def __evaluate__(self, js, cb=True, eval_id=None):
         if "evaluate_javascript" in self.webview:
             self.webview.evaluate_javascript(
-                js, len(js), None, None, None, self.__on_evaluate__ if cb else NOP, None
+                js, len(js), None, None, None, self.__on_evaluate__ if cb else NOP, eval_id
             )
         else:
-            self.webview.run_javascript(js, None, self.__on_run_javascript__ if cb else NOP, None)
+            self.webview.run_javascript(js, None, self.__on_run_javascript__ if cb else NOP, eval_id)
 
     def evaluate(self, js="", ondone=NOP):
         # info(f"Evaluating {js}")
-        result = Future()
+        result = aio.get_loop().create_future()
 
         def onCompletion(v):
             ondone(v)
-            result.set_result(v)
+            if not result.done():
+                result.set_result(v)
+                aio.wake()
 
         if js == "":
             warn("evaluate() called with no source code")
             return
         eval_id = self._eval_cnt
-        # Store the JavaScript code with the eval ID
-        self._js_code_map[eval_id] = js
+        # Keep the recent sources around for error messages
+        self._js_code_map.append((eval_id, js))
         js = f"[{eval_id}, ({js})]"
-        self._evaluate_list[eval_id] = onCompletion
-        self.__evaluate__(js)
+        deadline = GLib.get_monotonic_time() / 1e6 + self._eval_timeout
+        self._evaluate_list[eval_id] = [onCompletion, result, deadline]
+        if self._eval_sweeper is None and self._eval_timeout > 0:
+            self._eval_sweeper = GLib.timeout_add_seconds(1, self._sweep_evaluations)
+        self._profiled("webview.evaluate", self.__evaluate__, js, True, eval_id)
         self._eval_cnt += 1
         return result
 
@@ -109,20 +224,30 @@ class Webview:
         self._onload_listeners.append([fn, noOfTimes])
 
     def _onload(self, _, evt):
+        if evt == self.LOAD_STARTED:
+            # Results of evaluations against the previous page never come back, nor are its blobs fetched
+            self._drop_pending()
+            self.blobs.drop(self)
         if evt == self.LOAD_FINISHED:
             for idx in range(0, len(self._onload_listeners)):
                 if self._onload_listeners[idx][1] > 0:
-                    self._onload_listeners[idx][0]()
+                    fn = self._onload_listeners[idx][0]
+                    self._profiled(f"onload.{hook_name(fn)}", fn)
                 self._onload_listeners[idx][1] -= 1
 
     def register_handler(self, name, onmessage=NOP):
         self.webucm.register_script_message_handler(name)
-        self.webucm.connect(
-            f"script-message-received::{name}",
-            lambda _, x: onmessage(jsv_to_primitive(x.get_js_value())),
-        )
+        def on_message(_, x):
+            v = jsv_to_primitive(x.get_js_value())
+            metrics.received(name, message_size(v))
+            onmessage(v)
+
+        self.webucm.connect(f"script-message-received::{name}", on_message)
 
     def _welcome_msg(self):
+        if Webview._welcomed:
+            return
+        Webview._welcomed = True
         print("✨ \u001b[1mTINYWS\u001b[0m ✨")
         info(
             f"Using Gtk Version {Gtk.get_major_version()}.{Gtk.get_minor_version()}.{Gtk.get_micro_version()}"
@@ -154,8 +279,32 @@ class Webview:
         width="800",
         height="600",
         ephemeral=True,
-        capabilities=[]
+        capabilities=[],
+        eval_timeout=30,
+        eval_history=32,
+        shared_context=False,
+        profile=None,
+        encoder=None,
+        metrics_socket=None,
+        profiling=None,
+        snapshot=False,
+        snapshot_interval=0,
+        assets=None,
+        flush_replies_on_frame=False,
     ):
+        self._onload_listeners = []
+        self._capabilities = []
+        self._stylesheets = {}  # name -> (source, WebKit2.UserStyleSheet)
+        self._scripts = {}  # name -> (source, WebKit2.UserScript)
+        self.encoder = get_encoder(encoder)
+        self._evaluate_list = {}
+        self._js_code_map = collections.deque(maxlen=eval_history)
+        self._eval_cnt = 0
+        self._eval_timeout = eval_timeout
+        self.eval_stats = {"evicted": 0, "timed_out": 0, "failed": 0}
+        self.flush_replies_on_frame = flush_replies_on_frame
+        self.profiler = get_profiler(profiling)
+
         if isinstance(width, str) and width.endswith("%"):
             width = width.strip()
             width = int(float(width[:-1]) / 100 * Gdk.Screen.width())
@@ -175,9 +324,24 @@ class Webview:
         )
         self.window.set_position(position)
         self.window.set_default_size(width, height)
-        self.webctx = WebKit2.WebContext.new() if not ephemeral else WebKit2.WebContext.new_ephemeral() 
+        self.profile = get_profile(profile)
+        if shared_context:
+            self.webctx = Webview.shared_context(ephemeral, self.profile)
+        else:
+            self.webctx = Webview._new_context(ephemeral, self.profile)
         self.webview = WebKit2.WebView.new_with_context(self.webctx)
 
+        # Binary results are fetched from tinyws://blob/<id> instead of going through JSON
+        self.blobs = Webview._blob_store(self.webctx)
+
+        # Local files are served from one in-memory cache shared by every widget of the process
+        Webview._serve_assets(self.webctx)
+        for name, directory in (assets or {}).items():
+            if isinstance(directory, tuple):
+                asset_server.mount(name, *directory)
+            else:
+                asset_server.mount(name, directory)
+
         self._welcome_msg()
         info(f"Creating window of size ({width}, {height})")
 
@@ -202,14 +366,10 @@ class Webview:
         self.webcfg.set_allow_universal_access_from_file_urls(True)
         self.webcfg.set_allow_file_access_from_file_urls(True)
         self.webcfg.set_enable_developer_extras(True)
+        if self.profile:
+            self.profile.apply_settings(self.webcfg)
         self.webview.set_settings(self.webcfg)
 
-        if url:
-            self.webview.load_uri(url)
-
-        if html:
-            self.webview.load_html(html, "file://")
-
         self.webucm = self.webview.get_user_content_manager()
 
         if inspect:
@@ -224,29 +384,94 @@ class Webview:
                 persistent[1], WebKit2.CookiePersistentStorage.TEXT
             )
 
+        if metrics_socket:
+            metrics.serve(metrics_socket)
+
         self.onload(lambda: self.evaluate("console.log(`[tinyws] Ready!`)"), 1)
         self._capabilities = capabilities
-        self.onload(self.registerCapabilities)
+        self.registerCapabilities()
 
-        self.window.add(self.webview)
+        # Loaded after the capabilities so the first document already gets their user script
+        if snapshot:
+            from .snapshot import Snapshotter
+
+            # Loaded once the size is known, and only if there is no cached picture of it
+            self.snapshotter = Snapshotter(
+                self, url or html or "", lambda: self._load(url, html), snapshot_interval, transparent
+            )
+            self.window.add(self.snapshotter.stack)
+        else:
+            self._load(url, html)
+            self.window.add(self.webview)
 
-        if exit_on_window_close:
-            self.window.connect("destroy", lambda _: self.__cleanup__())
+        Webview._open.add(self)
+        self.window.connect("destroy", lambda _: self.__cleanup__(exit_on_window_close))
 
         self.webview.connect("load-changed", self._onload)
 
         if visible:
             self.window.show_all()
 
+    def _load(self, url=None, html=None):
+        if url:
+            self.webview.load_uri(url)
+
+        if html:
+            self.webview.load_html(html, "file://")
+
+    def invalidate_snapshot(self):
+        """In snapshot mode, renders the page again instead of showing the cached picture"""
+        if self.snapshotter:
+            self.snapshotter.invalidate()
+
     def registerCapabilities(self):
-        self.evaluate("(() => { window.capabilities = {} })()")
+        from .capabilities.runtime import runtime_script
+        from .capabilities.registry import lazy
+
+        # Capabilities given by name are only imported when the page first uses them
+        self._capabilities = [lazy(cap) if isinstance(cap, str) else cap for cap in self._capabilities]
         for cap in self._capabilities:
             cap.__register__(self)
+        # Runs before any page script on every load, so there is nothing to re-send after LOAD_FINISHED
+        self.set_script("tinyws.runtime", runtime_script(self._capabilities), WebKit2.UserScriptInjectionTime.START)
 
     def __enter__(self):
         return self
 
-    def __cleanup__(self):
+    @staticmethod
+    def _new_context(ephemeral=True, profile: Profile = None) -> WebKit2.WebContext:
+        if profile:
+            return profile.create_context(ephemeral)
+        return WebKit2.WebContext.new() if not ephemeral else WebKit2.WebContext.new_ephemeral()
+
+    @staticmethod
+    def shared_context(ephemeral=True, profile=None) -> WebKit2.WebContext:
+        """One WebContext (and so one network process) for all widgets created with `shared_context=True`"""
+        profile = get_profile(profile)
+        key = (ephemeral, profile.name if profile else None)
+        if key not in Webview._shared_contexts:
+            Webview._shared_contexts[key] = Webview._new_context(ephemeral, profile)
+        return Webview._shared_contexts[key]
+
+    @staticmethod
+    def _blob_store(ctx: WebKit2.WebContext) -> BlobStore:
+        # A scheme can only be registered once per context
+        if ctx not in Webview._blob_stores:
+            store = Webview._blob_stores[ctx] = BlobStore()
+            ctx.register_uri_scheme(BLOB_SCHEME, store.serve)
+            ctx.get_security_manager().register_uri_scheme_as_cors_enabled(BLOB_SCHEME)
+        return Webview._blob_stores[ctx]
+
+    @staticmethod
+    def _serve_assets(ctx: WebKit2.WebContext):
+        if ctx not in Webview._asset_contexts:
+            Webview._asset_contexts.add(ctx)
+            ctx.register_uri_scheme(ASSET_SCHEME, asset_server.serve)
+            security = ctx.get_security_manager()
+            security.register_uri_scheme_as_cors_enabled(ASSET_SCHEME)
+            security.register_uri_scheme_as_secure(ASSET_SCHEME)
+
+    def __cleanup__(self, quit=True):
         if self._store_session != "":
             session_state = self.webview.get_session_state()
             session_state_data = session_state.serialize().get_data()
@@ -254,7 +479,27 @@ class Webview:
             with open(self._store_session, "wb") as f:
                 f.write(session_state_data)
 
-        Gtk.main_quit()
+        if self.profiler:
+            self.profiler.dump()
+
+        if self.snapshotter:
+            self.snapshotter.stop()
+
+        # Shared capabilities must stop dispatching to this window
+        for cap in self._capabilities:
+            cap.__detach__(self)
+
+        self.blobs.drop(self)
+        Webview._open.discard(self)
+        if not Webview._open:
+            from .capabilities import workers
+
+            # Recreated on demand should another Webview be opened later
+            workers.shutdown()
+        # Other widgets in this process keep the main loop alive
+        if quit and not Webview._open:
+            aio.stop()
 
     def run(self):
-        Gtk.main()
+        """Runs the main loop for every Webview in the process, call it once after creating them all"""
+        aio.run()
@@ -0,0 +1,171 @@
+import math
+import heapq
+import asyncio
+import selectors
+from .utils.logger import info
+from gi.repository import Gtk, GLib  # type: ignore
+
+# One asyncio event loop shared with the GLib main loop, so `await webview.evaluate(...)` and
+# `async def` capability methods work without any extra threads.
+#
+# PyGObject >= 3.50 ships a real GLib backed asyncio loop (gi.events), on older versions
+# we fall back to stepping a regular asyncio loop from GLib sources whenever it has work.
+
+_loop: asyncio.AbstractEventLoop = None
+_native = False
+_source = None
+_due = 0.0
+
+
+class _SteppedLoop(asyncio.SelectorEventLoop):
+    """Tells GLib when it has work: everything scheduled on the loop goes through call_soon/call_at and
+    file descriptors it waits on get a GLib watch from its selector, so it never needs to be polled"""
+
+    def __init__(self):
+        super().__init__(_WatchedSelector())
+        self._deadlines = []  # heap of call_at times, GLib timers may fire a little before them
+
+    def call_soon(self, *args, **kwargs):
+        handle = super().call_soon(*args, **kwargs)
+        wake()
+        return handle
+
+    def call_at(self, when, *args, **kwargs):
+        handle = super().call_at(when, *args, **kwargs)
+        heapq.heappush(self._deadlines, when)
+        wake(max(0.0, when - self.time()))
+        return handle
+
+    def next_deadline(self):
+        """The earliest call_at time still in the future, cancelled ones included"""
+        now = self.time()
+        while self._deadlines and self._deadlines[0] <= now:
+            heapq.heappop(self._deadlines)
+        return self._deadlines[0] if self._deadlines else None
+
+    def call_soon_threadsafe(self, *args, **kwargs):
+        handle = super().call_soon_threadsafe(*args, **kwargs)
+        # May come from another thread, only GLib.idle_add is safe there
+        GLib.idle_add(_wake_idle)
+        return handle
+
+
+class _WatchedSelector(selectors.DefaultSelector):
+    """Gives every file descriptor the stepped loop waits on a GLib watch that wakes it"""
+
+    def __init__(self):
+        super().__init__()
+        self._watches = {}  # fd -> GLib source id
+
+    def register(self, fileobj, events, data=None):
+        key = super().register(fileobj, events, data)
+        self._watch(key)
+        return key
+
+    def modify(self, fileobj, events, data=None):
+        key = super().modify(fileobj, events, data)
+        self._watch(key)
+        return key
+
+    def unregister(self, fileobj):
+        key = super().unregister(fileobj)
+        source = self._watches.pop(key.fd, None)
+        if source is not None:
+            GLib.source_remove(source)
+        return key
+
+    def _watch(self, key):
+        source = self._watches.pop(key.fd, None)
+        if source is not None:
+            GLib.source_remove(source)
+        condition = GLib.IOCondition.HUP | GLib.IOCondition.ERR
+        if key.events & selectors.EVENT_READ:
+            condition |= GLib.IOCondition.IN
+        if key.events & selectors.EVENT_WRITE:
+            condition |= GLib.IOCondition.OUT
+        self._watches[key.fd] = GLib.io_add_watch(key.fd, GLib.PRIORITY_DEFAULT, condition, _wake_io)
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _native
+    if _loop is None:
+        try:
+            from gi.events import GLibEventLoopPolicy  # type: ignore
+            policy = GLibEventLoopPolicy()
+            asyncio.set_event_loop_policy(policy)
+            # On the main thread this is the loop of the default GLib.MainContext, the one GTK and
+            # GLib.idle_add/timeout_add use. new_event_loop() would get a private context instead
+            _loop = policy.get_event_loop()
+            _native = True
+        except ImportError:
+            _native = False
+            _loop = _SteppedLoop()
+            asyncio.set_event_loop(_loop)
+        info(f"Using {'GLib' if _native else 'stepped'} asyncio event loop")
+    return _loop
+
+
+def wake(delay=0.0):
+    """Makes sure the loop gets to run in `delay` seconds, a no-op with the native loop"""
+    global _source, _due
+    loop = get_loop()
+    if _native:
+        return
+    due = loop.time() + delay
+    if _source is not None:
+        if _due <= due:
+            return
+        GLib.source_remove(_source)
+    _due = due
+    if delay > 0:
+        _source = GLib.timeout_add(math.ceil(delay * 1000), _step)
+    else:
+        _source = GLib.idle_add(_step)
+
+
+def _wake_idle():
+    wake()
+    return GLib.SOURCE_REMOVE
+
+
+def _wake_io(fd, condition):
+    wake()
+    return GLib.SOURCE_CONTINUE
+
+
+def _step():
+    global _source
+    _source = None
+    # Runs exactly one iteration of the loop, the stop callback is already ready so it does not block.
+    # Whatever that iteration schedules wakes the loop again through call_soon/call_at
+    asyncio.SelectorEventLoop.call_soon(_loop, _loop.stop)
+    _loop.run_forever()
+    # A timer that was not quite due yet when GLib fired
+    deadline = _loop.next_deadline()
+    if deadline is not None:
+        wake(max(0.0, deadline - _loop.time()))
+    return GLib.SOURCE_REMOVE
+
+
+def ensure_future(aw, ondone=None) -> asyncio.Future:
+    fut = asyncio.ensure_future(aw, loop=get_loop())
+    if ondone:
+        fut.add_done_callback(ondone)
+    wake()
+    return fut
+
+
+def run():
+    loop = get_loop()
+    if _native:
+        loop.run_forever()
+    else:
+        wake()
+        Gtk.main()
+
+
+def stop():
+    if _native:
+        _loop.stop()
+    else:
+        Gtk.main_quit()
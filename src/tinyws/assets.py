@@ -0,0 +1,188 @@
+import os
+import gi
+import gzip
+import json
+import zlib
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit, unquote
+from .utils.logger import info, warn
+from .metrics import metrics
+from gi.repository import Gio, GLib, WebKit2  # type: ignore
+
+SCHEME = "tinyws-asset"
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+# Files shipped only precompressed are inflated once into the cache. WebKit neither sends Accept-Encoding
+# nor decodes Content-Encoding for custom schemes, so the page always gets plain bytes
+_INFLATE = {".gz": gzip.decompress}
+if brotli is not None:
+    _INFLATE[".br"] = brotli.decompress
+
+mimetypes.add_type("font/woff2", ".woff2")
+mimetypes.add_type("font/woff", ".woff")
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("text/javascript", ".mjs")
+
+# Response headers need WebKit2GTK 2.36 and the libsoup2 bindings WebKit2 4.0 is linked against,
+# loading Soup 3 next to it aborts the process. Without them only the body is sent
+_HAS_RESPONSES = hasattr(WebKit2, "URISchemeResponse")
+if _HAS_RESPONSES:
+    try:
+        gi.require_version("Soup", "2.4")
+        from gi.repository import Soup  # type: ignore
+    except (ValueError, ImportError):
+        _HAS_RESPONSES = False
+
+
+def _map(path: str) -> GLib.Bytes:
+    # Backed by the page cache, every window serving the file shares the same pages
+    if os.path.getsize(path) == 0:
+        return GLib.Bytes.new(b"")
+    return GLib.MappedFile.new(path, False).get_bytes()
+
+
+class Asset:
+    def __init__(self, path: str, st: os.stat_result):
+        self.path = path
+        self.stamp = (st.st_mtime_ns, st.st_size)
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.mtime = int(st.st_mtime)
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self.mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if os.path.exists(path):
+            self.data = _map(path)
+            return
+        for suffix, inflate in _INFLATE.items():
+            if os.path.exists(path + suffix):
+                with open(path + suffix, "rb") as f:
+                    self.data = GLib.Bytes.new(inflate(f.read()))
+                return
+        raise FileNotFoundError(path)
+
+
+class AssetServer:
+    """Serves mounted directories on `tinyws-asset://<mount>/<path>` from a process wide in-memory cache.
+
+    Files are memory mapped on first use (or up front, from a preload manifest) and revalidated with a
+    stat() per request, responses carry an ETag and Last-Modified and conditional requests get a 304.
+    A file only shipped as `file.js.gz` (or `.br`, with the brotli package) is served inflated"""
+
+    def __init__(self):
+        self.mounts: Dict[str, str] = {}
+        self._cache: Dict[str, Asset] = {}  # absolute path -> Asset
+        self.max_age = 0  # Seconds the page may reuse a response without asking again
+        self.stats = {"hits": 0, "loads": 0, "not_modified": 0, "not_found": 0, "bytes": 0}
+
+    def mount(self, name: str, directory: str, preload=None):
+        """Serves `directory` under `tinyws-asset://<name>/`, `preload` lists paths (relative to the
+        directory) to load right away, or names a JSON manifest in the directory holding that list"""
+        self.mounts[name] = os.path.realpath(directory)
+        if isinstance(preload, str):
+            try:
+                with open(os.path.join(directory, preload)) as f:
+                    preload = json.load(f)
+            except (OSError, ValueError) as e:
+                warn(f"Could not read the asset manifest {preload}: {e}")
+                preload = None
+        for rel in preload or []:
+            if self._get(self._resolve(name, rel)) is None:
+                warn(f"Preloaded asset {name}/{rel} does not exist")
+        info(f"Serving {directory} on {SCHEME}://{name}/")
+
+    def _resolve(self, name: str, rel: str) -> Optional[str]:
+        root = self.mounts.get(name)
+        if root is None:
+            return None
+        path = os.path.realpath(os.path.join(root, rel.lstrip("/")))
+        # No escaping the mounted directory with .. or symlinks
+        if path != root and not path.startswith(root + os.sep):
+            return None
+        return path
+
+    def _get(self, path: Optional[str]) -> Optional[Asset]:
+        if path is None:
+            return None
+        st = None
+        for candidate in (path, *(path + suffix for suffix in _INFLATE)):
+            try:
+                st = os.stat(candidate)
+                break
+            except OSError:
+                continue
+        if st is None:
+            self._cache.pop(path, None)
+            return None
+        asset = self._cache.get(path)
+        if asset is not None and asset.stamp == (st.st_mtime_ns, st.st_size):
+            self.stats["hits"] += 1
+            return asset
+        try:
+            asset = self._cache[path] = Asset(path, st)
+        except (OSError, EOFError, zlib.error, GLib.Error) as e:
+            warn(f"Could not load asset {path}: {e}")
+            return None
+        self.stats["loads"] += 1
+        return asset
+
+    def serve(self, request):
+        url = urlsplit(request.get_uri())
+        asset = self._get(self._resolve(url.netloc, unquote(url.path)))
+        if asset is None:
+            self.stats["not_found"] += 1
+            request.finish_error(GLib.Error.new_literal(
+                Gio.io_error_quark(), f"No such asset {request.get_uri()}", Gio.IOErrorEnum.NOT_FOUND
+            ))
+            return
+
+        if not _HAS_RESPONSES:
+            self._finish(request, asset.data, asset.mime)
+            return
+
+        headers = request.get_http_headers()
+        status, body = 200, asset.data
+        if headers is not None and self._not_modified(asset, headers):
+            status, body = 304, GLib.Bytes.new(b"")
+            self.stats["not_modified"] += 1
+
+        response_headers = Soup.MessageHeaders.new(Soup.MessageHeadersType.RESPONSE)
+        response_headers.append("ETag", asset.etag)
+        response_headers.append("Last-Modified", asset.last_modified)
+        response_headers.append("Cache-Control", f"max-age={self.max_age}" if self.max_age else "no-cache")
+        response = WebKit2.URISchemeResponse.new(Gio.MemoryInputStream.new_from_bytes(body), body.get_size())
+        response.set_status(status, None)
+        response.set_content_type(asset.mime)
+        response.set_http_headers(response_headers)
+        self.stats["bytes"] += body.get_size()
+        metrics.sent("assets", body.get_size())
+        request.finish_with_response(response)
+
+    def _finish(self, request, body: GLib.Bytes, mime: str):
+        self.stats["bytes"] += body.get_size()
+        metrics.sent("assets", body.get_size())
+        request.finish(Gio.MemoryInputStream.new_from_bytes(body), body.get_size(), mime)
+
+    @staticmethod
+    def _not_modified(asset: Asset, headers) -> bool:
+        etags = headers.get_one("If-None-Match")
+        if etags:
+            return asset.etag in etags or etags.strip() == "*"
+        since = headers.get_one("If-Modified-Since")
+        if since:
+            try:
+                return asset.mtime <= parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+assets = AssetServer()
+
+
+def mount(name: str, directory: str, preload=None):
+    assets.mount(name, directory, preload)
@@ -0,0 +1,161 @@
+import sys
+import struct
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from .utils.logger import warn
+from .metrics import metrics
+from gi.repository import Gio, GLib  # type: ignore
+
+SCHEME = "tinyws"
+MARKER = "__tinyws_blob__"
+
+# Typed array used on the JS side, by (struct format kind, itemsize)
+_TYPED_ARRAYS = {
+    ("f", 4): "Float32Array",
+    ("f", 8): "Float64Array",
+    ("i", 1): "Int8Array",
+    ("i", 2): "Int16Array",
+    ("i", 4): "Int32Array",
+    ("i", 8): "BigInt64Array",
+    ("u", 1): "Uint8Array",
+    ("u", 2): "Uint16Array",
+    ("u", 4): "Uint32Array",
+    ("u", 8): "BigUint64Array",
+}
+
+
+def is_binary(v) -> bool:
+    # NumPy arrays are detected by duck typing so numpy is never imported here
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return True
+    return hasattr(v, "__array_interface__") and getattr(v, "ndim", 0) > 0
+
+
+# Native format of the same kind and size, for explicit byte order formats like '<d' or '>i' (NumPy dtypes)
+_NATIVE = {
+    **{("i", struct.calcsize(c)): c for c in "qlihb"},
+    **{("u", struct.calcsize(c)): c for c in "QLIHB"},
+    ("f", 4): "f",
+    ("f", 8): "d",
+}
+
+
+def _native_format(mv: memoryview):
+    """The native struct format for `mv`'s items and whether their bytes need swapping, None if there is none"""
+    fmt = mv.format
+    order = fmt[0] if fmt[0] in "@=<>!" else "@"
+    code = fmt.lstrip("@=<>!")
+    if order == "@":
+        return code, False
+    kind = "f" if code in ("e", "f", "d") else "u" if code.isupper() else "i"
+    native = _NATIVE.get((kind, mv.itemsize))
+    if native is None or code in ("e", "?", "c", "s", "x"):
+        return None
+    swap = mv.itemsize > 1 and {"<": "little", ">": "big", "!": "big"}.get(order, sys.byteorder) != sys.byteorder
+    return native, swap
+
+
+def _as_memoryview(v) -> memoryview:
+    mv = memoryview(v)
+    native = _native_format(mv)
+    if native is None:
+        # Nothing javascript has a typed array for, sent as raw bytes
+        return memoryview(mv.tobytes())
+    fmt, swap = native
+    if swap:
+        data, n = mv.tobytes(), mv.itemsize
+        swapped = bytearray(len(data))
+        for i in range(n):
+            swapped[i::n] = data[n - 1 - i::n]
+        return memoryview(swapped).cast(fmt)
+    if not mv.c_contiguous or fmt != mv.format:
+        mv = memoryview(mv.tobytes()).cast(fmt)
+    return mv
+
+
+def _typed_array(mv: memoryview) -> str:
+    fmt = mv.format.lstrip("@=<")
+    if fmt in ("f", "d"):
+        kind = "f"
+    elif fmt in ("b", "h", "i", "l", "q"):
+        kind = "i"
+    elif fmt in ("B", "H", "I", "L", "Q"):
+        kind = "u"
+    else:
+        return "ArrayBuffer"
+    if isinstance(mv.obj, (bytes, bytearray)) and fmt == "B":
+        return "ArrayBuffer"
+    return _TYPED_ARRAYS.get((kind, mv.itemsize), "ArrayBuffer")
+
+
+class BlobStore:
+    """Binary payloads waiting to be fetched by javascript through `tinyws://blob/<id>`,
+    each blob is served once, the oldest ones are dropped past `max_bytes`"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._blobs: "OrderedDict[int, GLib.Bytes]" = OrderedDict()
+        self._owners = {}  # blob id -> the webview it was sent to, one store serves a whole WebContext
+        self._size = 0
+        self._next_id = 0
+        self.stats = {"stored": 0, "served": 0, "dropped": 0, "bytes": 0}
+
+    def put(self, v, owner=None) -> dict:
+        mv = _as_memoryview(v)
+        data = GLib.Bytes.new(v if isinstance(v, bytes) else mv.tobytes())
+        blob_id = self._next_id
+        self._next_id += 1
+        self._blobs[blob_id] = data
+        self._owners[blob_id] = owner
+        self._size += data.get_size()
+        self.stats["stored"] += 1
+        while self._size > self.max_bytes and len(self._blobs) > 1:
+            old_id, old = self._blobs.popitem(last=False)
+            self._owners.pop(old_id, None)
+            self._size -= old.get_size()
+            self.stats["dropped"] += 1
+        return {MARKER: blob_id, "type": _typed_array(mv)}
+
+    def wrap(self, v, owner=None):
+        """Replaces binary values, also inside dicts, lists and tuples, with a marker the JS runtime resolves
+        with fetch(). Values without any are returned as they are"""
+        if is_binary(v):
+            return self.put(v, owner)
+        if isinstance(v, dict):
+            items = {k: self.wrap(x, owner) for k, x in v.items()}
+            return items if any(items[k] is not x for k, x in v.items()) else v
+        if isinstance(v, (list, tuple)):
+            items = [self.wrap(x, owner) for x in v]
+            return items if any(a is not b for a, b in zip(items, v)) else v
+        return v
+
+    def drop(self, owner):
+        """Forgets the blobs sent to `owner`, its page navigated away and will never fetch them"""
+        for blob_id in [i for i, o in self._owners.items() if o is owner]:
+            del self._owners[blob_id]
+            self._size -= self._blobs.pop(blob_id).get_size()
+            self.stats["dropped"] += 1
+
+    def serve(self, request):
+        url = urlsplit(request.get_uri())
+        data = None
+        if url.netloc == "blob":
+            try:
+                blob_id = int(url.path.strip("/"))
+                data = self._blobs.pop(blob_id)
+                self._owners.pop(blob_id, None)
+            except (KeyError, ValueError):
+                pass
+        if data is None:
+            warn("Unknown blob requested: %s", request.get_uri())
+            request.finish_error(GLib.Error.new_literal(
+                Gio.io_error_quark(), f"No such blob {request.get_uri()}", Gio.IOErrorEnum.NOT_FOUND
+            ))
+            return
+        self._size -= data.get_size()
+        self.stats["served"] += 1
+        self.stats["bytes"] += data.get_size()
+        metrics.sent("blobs", data.get_size())
+        # WebKit reads the stream in chunks, large payloads are never copied into one JS string
+        stream = Gio.MemoryInputStream.new_from_bytes(data)
+        request.finish(stream, data.get_size(), "application/octet-stream")
@@ -1,106 +1,206 @@
-from logging import critical
 from typing import Callable, Dict, Any
-import json
-from ..utils.logger import info, warn, error
-from .. import Webview
+from ..utils.logger import info, warn, error, critical
+from .. import Webview, GLib, aio
+from ..metrics import metrics
+from . import workers
+from collections import deque
+import asyncio
+import concurrent.futures
+import inspect
+import time
 import traceback
 
 
-def export(fn):
+def export(fn=None, *, pool=None):
+    """Exposes a method to javascript, use `@export(pool="thread")` or `@export(pool="process")`
+    to run it on a worker pool instead of the GTK main thread.
+
+    Process pool exports must be static methods (or module level functions), they are called in a
+    spawned worker with only the arguments from javascript, the capability itself is never pickled"""
+    if fn is None:
+        return lambda fn: export(fn, pool=pool)
+    if isinstance(fn, staticmethod):
+        export(fn.__func__, pool=pool)
+        return fn
+    if pool == workers.PROCESS and next(iter(inspect.signature(fn).parameters), None) == "self":
+        raise TypeError(f"'{fn.__qualname__}' takes self, @export(pool=\"process\") needs a @staticmethod")
     fn.__exported__ = fn.__name__
+    fn.__pool__ = pool
     return fn
 
 
+class ResponseQueue:
+    """Collects capability replies and sends them to JS in one evaluate() per main loop iteration"""
+
+    def __init__(self, wv: Webview, on_tick=False):
+        self.wv = wv
+        self.on_tick = on_tick
+        self._pending = []
+        self._scheduled = False
+        self.stats = {"flushes": 0, "replies": 0, "last_batch": 0, "max_batch": 0}
+
+    def push(self, capability: str, callback_id, result=None, error=None):
+        wrapped = self.wv.blobs.wrap(result, self.wv)
+        # Only results holding blob markers are walked by the JS side
+        self._pending.append([capability, callback_id, error, wrapped, wrapped is not result])
+        if not self._scheduled:
+            self._scheduled = True
+            if self.on_tick:
+                # Flush right before the next frame is drawn
+                self.wv.webview.add_tick_callback(self._flush_source)
+            else:
+                GLib.idle_add(self._flush_source)
+
+    def _flush_source(self, *_):
+        self.flush()
+        return GLib.SOURCE_REMOVE
+
+    def flush(self) -> int:
+        self._scheduled = False
+        replies, self._pending = self._pending, []
+        if replies:
+            payload = self.wv.encoder.encode(replies)
+            metrics.sent("replies", len(payload))
+            self.wv.evaluate(f"window.__tinyws_resolve({payload})")
+            self.stats["flushes"] += 1
+            self.stats["replies"] += len(replies)
+            self.stats["last_batch"] = len(replies)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(replies))
+        return len(replies)
+
+    @staticmethod
+    def of(wv: Webview) -> "ResponseQueue":
+        if getattr(wv, "responses", None) is None:
+            wv.responses = ResponseQueue(wv, on_tick=wv.flush_replies_on_frame)
+        return wv.responses
+
+
 class Capability:
     @staticmethod
     def name() -> str:
         raise NotImplementedError("Must be implemented in subclass")
 
     __exported_methods__: Dict[str, Callable] = {}
-    wv: Webview
+    wv: Webview  # The first webview this capability was registered on
+    webviews: list  # Every webview sharing this instance
+    caller: Webview = None  # The webview whose call is being handled, only set during synchronous exports
+
+    # Maximum number of pooled calls of this capability running at once, the rest wait in a backlog
+    max_concurrency = 4
 
     def __init__(self) -> None:
         self.__exported_methods__ = {}
-
-    def __register__(self, wv: Webview):
-        self.wv = wv
+        self.webviews = []
+        self.__in_flight = 0
+        self.__backlog = deque()
+
+    def __attach__(self, wv: Webview):
+        """Python side bookkeeping for a new webview, without touching its message handlers"""
+        if not self.webviews:
+            self.wv = wv
+        self.webviews.append(wv)
         for kName in dir(self):
             v = getattr(self, kName)
             if hasattr(v, "__exported__"):
+                if v.__pool__ == workers.PROCESS and inspect.ismethod(v):
+                    raise TypeError(f"'{self.name()}.{v.__exported__}' is bound to the capability, "
+                                    f"@export(pool=\"process\") needs a @staticmethod")
                 self.__exported_methods__[v.__exported__] = v
 
-        # Register message handler
-        wv.register_handler(name=self.name(), onmessage=self.__on_message__)
-
-        # Create JS object with all exported methods
-        js_methods = ", ".join(
-            f"""
-{name}: (...args) => new Promise((resolve, reject) => {{
-    const callbackId = crypto.randomUUID();  // Generate a unique callback ID
-    window.capabilities["{self.name()}"].__callbacks[callbackId] = {{
-        resolve: resolve,
-        reject: reject
-    }};
-    window.webkit.messageHandlers['{self.name()}'].postMessage({{
-        method: '{name}',
-        args: args,
-        callbackId: callbackId
-    }})
-}})
-"""
-            for name in self.__exported_methods__
-        )
-
-        # Register JavaScript side
-        wv.evaluate(f"""
-        (() => {{
-            window.capabilities = window.capabilities ?? {{}}
-            window.capabilities["{self.name()}"] = {{
-                __callbacks: {{}},
-                {js_methods}
-            }};
-            console.log(`[tinyws] Capability {self.name()} was successfully loaded!`)
-            // window.capabilities['hello'].getTimestamp().then(v => {{
-            //    console.log(+Date.now() - v, " millisecond communication between Py and Js")
-            // }})
-        }})()
-        """)
-        info(f"Capability '{self.name()}' was successfully loaded!")
-
-    def __on_message__(self, v):
+    def __detach__(self, wv: Webview):
+        """Forgets a webview whose window was closed, the other webviews keep using this instance"""
+        if wv in self.webviews:
+            self.webviews.remove(wv)
+        if self.webviews and self.wv is wv:
+            self.wv = self.webviews[0]
+
+    def __register__(self, wv: Webview):
+        self.__attach__(wv)
+
+        # Register message handler, replies go back to the webview the message came from
+        wv.register_handler(name=self.name(), onmessage=lambda v: self.__on_message__(v, wv))
+
+        info("Capability '%s' was successfully loaded!", self.name())
+
+    def __runtime__(self) -> str:
+        """Extra javascript run at document start, after `window.capabilities[name()]` exists"""
+        return ""
+
+    def __on_message__(self, v, wv: Webview = None):
         method_name = v.get("method")
         args = v.get("args", [])
-        callback_id = v.get("callbackId")
 
+        if method_name not in self.__exported_methods__:
+            # Lazy capabilities forward any property name, a typo must fail rather than hang
+            ResponseQueue.of(wv or self.wv).push(
+                self.name(), v.get("callbackId"), None, f"'{self.name()}' has no method '{method_name}'"
+            )
+            return
+        # Where the answer goes, and what the metrics need once it is sent
+        reply = (wv or self.wv, v.get("callbackId"), method_name, time.perf_counter())
+        metrics.call_started(self.name(), method_name)
+        fn = self.__exported_methods__[method_name]
+        if fn.__pool__:
+            self.__backlog.append((fn, args, reply))
+            self.__drain_backlog()
+            return
+
+        self.caller = reply[0]
+        try:
+            # print("Calling function " + method_name + " with args: ")
+            # __import__('pprint').pprint(args)
+            result = self.caller._profiled(f"{self.name()}.{method_name}", fn, self, *args)
+            if inspect.isawaitable(result):
+                aio.ensure_future(result, lambda f: self.__on_task_done(f, fn, reply))
+                return
+            self.__send_response(reply, result)
+        except Exception as e:
+            self.__send_error(method_name, reply, e, traceback.format_exc())
+        finally:
+            self.caller = None
+
+    def __on_task_done(self, task, fn, reply):
         try:
-            if method_name in self.__exported_methods__:
-                fn = self.__exported_methods__[method_name]
-                # print("Calling function " + method_name + " with args: ")
-                # __import__('pprint').pprint(args)
-                result = fn(self, *args)
-                self.__send_response(callback_id, result)
+            self.__send_response(reply, task.result())
+        except (asyncio.CancelledError, concurrent.futures.CancelledError):
+            # e.g. an awaited evaluate() timed out or its page navigated away, not an Exception
+            self.__send_response(reply, None, f"Call to '{fn.__exported__}' was cancelled")
         except Exception as e:
-            err = str(e)
-            critical(f"Error in method '{method_name}': {str(e)}")
-            error(traceback.format_exc())
-            self.__send_response(callback_id, None, err)
-
-    def __send_response(self, callback_id, result=None, error=None):
-        # This function sends the response back to JavaScript
-        js_code = f"""
-        (() => {{
-            const callback = window.capabilities["{self.name()}"].__callbacks['{callback_id}'];
-            if (callback) {{
-                if ({json.dumps(error)} !== null) {{
-                    callback.reject({json.dumps(error)});
-                }} else {{
-                    callback.resolve({json.dumps(result)});
-                }}
-                delete window.capabilities["{self.name()}"].__callbacks['{callback_id}'];
-            }}
-        }})()
-        """
-        self.wv.evaluate(js_code)  # Send the response back to the JavaScript side
+            self.__send_error(fn.__exported__, reply, e, traceback.format_exc())
+
+    def __drain_backlog(self):
+        while self.__backlog and self.__in_flight < self.max_concurrency:
+            fn, args, reply = self.__backlog.popleft()
+            self.__in_flight += 1
+            # Process workers only get the arguments, the capability stays on the GTK side
+            call_args = args if fn.__pool__ == workers.PROCESS else (self, *args)
+            try:
+                future = reply[0]._profiled(f"{self.name()}.{fn.__exported__}", workers.submit, fn.__pool__, fn, *call_args)
+            except Exception as e:
+                self.__in_flight -= 1
+                self.__send_error(fn.__exported__, reply, e, traceback.format_exc())
+                continue
+            # Worker threads must not touch GTK, hand the result back to the main loop
+            future.add_done_callback(
+                lambda f, fn=fn, reply=reply: GLib.idle_add(self.__on_pool_done, f, fn, reply)
+            )
+
+    def __on_pool_done(self, future, fn, reply):
+        self.__in_flight -= 1
+        self.__on_task_done(future, fn, reply)
+        self.__drain_backlog()
+        return GLib.SOURCE_REMOVE
+
+    def __send_error(self, method_name, reply, e, tb):
+        critical("Error in method '%s': %s", method_name, e)
+        error(tb)
+        self.__send_response(reply, None, str(e))
+
+    def __send_response(self, reply, result=None, error=None):
+        # Queued, the replies of one main loop iteration are sent back to JavaScript together
+        wv, callback_id, method_name, started = reply
+        metrics.call_finished(self.name(), method_name, (time.perf_counter() - started) * 1000, error is not None)
+        ResponseQueue.of(wv).push(self.name(), callback_id, result, error)
 
 
 class HelloCapability(Capability):
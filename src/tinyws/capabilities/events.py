@@ -1,60 +1,155 @@
 from typing import Type, Dict, Any
-from ..utils.logger import info
-from .. import Webview
+from ..utils.logger import info, throttled
+from .. import Webview, GLib
+from ..metrics import metrics
 from . import Capability, export
 import json
 
+# Pages may add and remove listeners in a loop
+_log_listener = throttled(info, interval=1.0)
+
+
+class LatestWins:
+    """Coalescing policy: of the emissions made before the next flush only the last one is dispatched"""
+    interval = 0
+
+    def key(self, detail):
+        return None
+
+
+class RateLimit(LatestWins):
+    """Latest wins, dispatching at most once every `interval` seconds"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+
+
+class MergeByKey(LatestWins):
+    """Keeps the last emission per `detail[key]`, each one is dispatched on flush"""
+
+    def __init__(self, key: str, interval: float = 0):
+        self.field = key
+        self.interval = interval
+
+    def key(self, detail):
+        return detail.get(self.field)
+
+
 class EventCapability(Capability):
     def __init__(self):
         super().__init__()
-        self._listeners: Dict[str, list] = {}
+        self._listeners: Dict[Webview, Dict[str, list]] = {}
+        self._load_handlers: Dict[Webview, int] = {}  # webview -> its load-changed handler id
+        self._policies: Dict[str, LatestWins] = {}
+        self._pending: Dict[str, dict] = {}
+        self._scheduled: Dict[str, int] = {}
+        self._last_flush: Dict[str, float] = {}
+        self.event_stats = {"emitted": 0, "dispatched": 0, "skipped": 0, "coalesced": 0}
 
     @staticmethod
     def name() -> str:
         raise NotImplementedError("Must be implemented in subclass")
 
-    def __register__(self, wv: Webview):
-        super().__register__(wv)
-
-        # Create EventTarget on JavaScript side
-        wv.evaluate(f"""(() => {{
-            class {self.name()}EventTarget extends EventTarget {{
-                constructor() {{
-                    super();
-                }}
-            }}
-            window.capabilities["{self.name()}"].eventTarget = new {self.name()}EventTarget();
-            window.capabilities["{self.name()}"].addEventListener = (type, listener) => {{
-                window.capabilities["{self.name()}"].eventTarget.addEventListener(type, listener);
-            }};
-            window.capabilities["{self.name()}"].removeEventListener = (type, listener) => {{
-                window.capabilities["{self.name()}"].eventTarget.removeEventListener(type, listener);
-            }};
-            console.log(`[tinyws] {self.name()}EventTarget created successfully!`);
-        }})();""")
+    def set_policy(self, event_type: str, policy: LatestWins = None):
+        """Coalesce bursts of `event_type`, see LatestWins, RateLimit and MergeByKey. None dispatches every emission"""
+        if policy is None:
+            self._policies.pop(event_type, None)
+        else:
+            self._policies[event_type] = policy
+
+    def __attach__(self, wv: Webview):
+        super().__attach__(wv)
+        self._listeners[wv] = {}
+        self._load_handlers[wv] = wv.webview.connect("load-changed", self._on_load_changed, wv)
+
+    def __detach__(self, wv: Webview):
+        super().__detach__(wv)
+        self._listeners.pop(wv, None)
+        handler = self._load_handlers.pop(wv, None)
+        if handler is not None:
+            wv.webview.disconnect(handler)
+
+    def _on_load_changed(self, _, evt, wv):
+        # A new document starts without any listeners
+        if evt == Webview.LOAD_STARTED and wv in self._listeners:
+            self._listeners[wv].clear()
+
+    def __runtime__(self) -> str:
+        # EventTarget backed add/removeEventListener, see runtime.py
+        return f"window.__tinyws.events(window.capabilities[{json.dumps(self.name())}]);"
 
     @export
-    def addEventListener(self, event_type: str, listener_id: str):
-        if event_type not in self._listeners:
-            self._listeners[event_type] = []
-        self._listeners[event_type].append(listener_id)
-        info(f"Added listener {listener_id} for event {event_type}")
+    def addEventListener(self, _, event_type: str, listener_id: str):
+        listeners = self._listeners[self.caller]
+        if event_type not in listeners:
+            listeners[event_type] = []
+        listeners[event_type].append(listener_id)
+        _log_listener("Added listener %s for event %s", listener_id, event_type)
 
     @export
-    def removeEventListener(self, event_type: str, listener_id: str):
-        if event_type in self._listeners and listener_id in self._listeners[event_type]:
-            self._listeners[event_type].remove(listener_id)
-            info(f"Removed listener {listener_id} for event {event_type}")
+    def removeEventListener(self, _, event_type: str, listener_id: str):
+        listeners = self._listeners[self.caller]
+        if event_type in listeners and listener_id in listeners[event_type]:
+            listeners[event_type].remove(listener_id)
+            if not listeners[event_type]:
+                del listeners[event_type]
+            _log_listener("Removed listener %s for event %s", listener_id, event_type)
+
+    def has_listeners(self, event_type: str, wv: Webview = None) -> bool:
+        if wv is not None:
+            return bool(self._listeners.get(wv, {}).get(event_type))
+        return any(listeners.get(event_type) for listeners in self._listeners.values())
 
     def emit_event(self, wv: Webview, event_type: str, detail: Dict[str, Any] = None):
+        # `wv` is kept for compatibility, events go to every webview sharing this capability that listens for them
+        self.event_stats["emitted"] += 1
+        if not self.has_listeners(event_type):
+            self.event_stats["skipped"] += 1
+            return
         if not detail:
             detail = {}
-        js_detail = json.dumps(detail)
-        wv.evaluate(f"""
-            const event = new CustomEvent("{event_type}", {{ detail: {js_detail} }});
-            window.capabilities["{self.name()}"].eventTarget.dispatchEvent(event);
-        """)
-        info(f"Emitted event {event_type} with detail: {detail}")
+
+        policy = self._policies.get(event_type)
+        if policy is None:
+            self._dispatch([[event_type, detail]])
+            return
+
+        pending = self._pending.setdefault(event_type, {})
+        if pending:
+            self.event_stats["coalesced"] += 1
+        pending.pop(policy.key(detail), None)
+        pending[policy.key(detail)] = detail
+        if event_type not in self._scheduled:
+            now = GLib.get_monotonic_time() / 1e6
+            wait = self._last_flush.get(event_type, -policy.interval) + policy.interval - now
+            if wait > 0:
+                self._scheduled[event_type] = GLib.timeout_add(int(wait * 1000), self._flush, event_type)
+            else:
+                self._scheduled[event_type] = GLib.idle_add(self._flush, event_type)
+
+    def _flush(self, event_type):
+        self._scheduled.pop(event_type, None)
+        self._last_flush[event_type] = GLib.get_monotonic_time() / 1e6
+        pending = self._pending.pop(event_type, {})
+        if pending and self.has_listeners(event_type):
+            self._dispatch([[event_type, detail] for detail in pending.values()])
+        return GLib.SOURCE_REMOVE
+
+    def _dispatch(self, events, webviews=None):
+        # All events of one dispatch share a type, `webviews` narrows who gets them
+        payloads = {}  # encoder -> payload, webviews may use different encoders
+        for wv in self.webviews if webviews is None else webviews:
+            if self.has_listeners(events[0][0], wv):
+                payload = payloads.get(wv.encoder)
+                if payload is None:
+                    payload = payloads[wv.encoder] = wv.encoder.encode(events)
+                self.event_stats["dispatched"] += len(events)
+                metrics.event_dispatched(self.name(), events[0][0], len(events))
+                metrics.sent("events", len(payload))
+                wv.evaluate(f"""((target, events) => {{
+            for (const [type, detail] of events) target.dispatchEvent(new CustomEvent(type, {{ detail }}));
+        }})(window.capabilities["{self.name()}"].eventTarget, {payload})""")
+
 
 class ExampleEventCapability(EventCapability):
     @staticmethod
@@ -63,4 +158,4 @@ class ExampleEventCapability(EventCapability):
 
     @export
     def triggerCustomEvent(self, wv: Webview, event_name: str, data: Dict[str, Any]):
-        self.emit_event(wv, event_name, data)
\ No newline at end of file
+        self.emit_event(wv, event_name, data)
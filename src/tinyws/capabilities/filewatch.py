@@ -0,0 +1,180 @@
+import os
+import json
+from typing import Dict, Any
+from ..utils.logger import info, warn
+from .. import Webview, GLib, Gio
+from . import export
+from .events import EventCapability
+
+# A burst of writes is reported once it has been quiet for this long...
+DEBOUNCE_MS = 150
+# ...or after this long, so a file that is written to all the time (a log) still gets events
+MAX_DELAY_MS = 1000
+
+_KINDS = {
+    Gio.FileMonitorEvent.CHANGED: "changed",
+    Gio.FileMonitorEvent.CHANGES_DONE_HINT: "changed",
+    Gio.FileMonitorEvent.CREATED: "created",
+    Gio.FileMonitorEvent.MOVED_IN: "created",
+    Gio.FileMonitorEvent.DELETED: "deleted",
+    Gio.FileMonitorEvent.MOVED_OUT: "deleted",
+    Gio.FileMonitorEvent.RENAMED: "moved",
+}
+
+# Points the page's <link rel="stylesheet">s to a changed file at a fresh URL, the browser swaps them without a reload
+_SWAP_LINKS_JS = """((path, seq) => {
+    for (const link of document.querySelectorAll('link[rel~="stylesheet"]')) {
+        const url = new URL(link.href, location.href);
+        if (url.pathname.length > 1 && path.endsWith(decodeURIComponent(url.pathname))) {
+            url.searchParams.set("tinyws-reload", seq);
+            link.href = url.href;
+        }
+    }
+})"""
+
+
+class FileWatchCapability(EventCapability):
+    """Watches files and directories with Gio.FileMonitor (inotify on linux) from the GLib main loop.
+
+    Bursts of changes are merged per path and dispatched, to the webviews watching them only, as `fileChanged` events with
+    `{path, kind: "changed" | "created" | "deleted" | "moved", to}`. Directories report changes of
+    their direct children. `watch(path, {hotSwapCss: true})` also re-applies changed stylesheets in the
+    webview that asked without reloading it, `{reload: true}` reloads it for any other change"""
+
+    @staticmethod
+    def name() -> str:
+        return "fileWatch"
+
+    def __init__(self, debounce_ms: int = DEBOUNCE_MS, max_delay_ms: int = MAX_DELAY_MS):
+        super().__init__()
+        self.debounce_ms = debounce_ms
+        self.max_delay_ms = max_delay_ms
+        self._monitors: Dict[str, Gio.FileMonitor] = {}
+        self._watchers: Dict[str, Dict[Webview, Dict[str, Any]]] = {}  # watched path -> webview -> options
+        self._injected: Dict[str, set] = {}  # stylesheet path -> webviews it was injected into
+        # (watched path, changed path) -> detail, waiting for the burst to end. A file inside a watched
+        # directory that is also watched itself is reported to both sets of watchers
+        self._changes: Dict[tuple, Dict[str, Any]] = {}
+        self._timer = None
+        self._first_change = 0
+        self._seq = 0
+
+    @export
+    def watch(self, _, path: str, options: Dict[str, Any] = None) -> str:
+        path = os.path.abspath(os.path.expanduser(path))
+        if path not in self._monitors:
+            gfile = Gio.File.new_for_path(path)
+            try:
+                if os.path.isdir(path):
+                    monitor = gfile.monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+                else:
+                    monitor = gfile.monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+            except GLib.Error as err:
+                raise OSError(f"Could not watch {path}: {err.message}")
+            monitor.connect("changed", self._on_changed, path)
+            self._monitors[path] = monitor
+            info("Watching %s", path)
+        self._watchers.setdefault(path, {})[self.caller] = options or {}
+        return path
+
+    @export
+    def unwatch(self, _, path: str):
+        path = os.path.abspath(os.path.expanduser(path))
+        watchers = self._watchers.get(path, {})
+        watchers.pop(self.caller, None)
+        if not watchers:
+            self._stop(path)
+
+    @export
+    def watched(self, _) -> list:
+        """The paths the calling webview watches"""
+        return [path for path, watchers in self._watchers.items() if self.caller in watchers]
+
+    @export
+    def injectStylesheet(self, _, path: str) -> str:
+        """Adds the stylesheet at `path` to the calling webview and keeps it up to date as the file changes"""
+        expanded = os.path.abspath(os.path.expanduser(path))
+        options = self._watchers.get(expanded, {}).get(self.caller, {})
+        path = self.watch(_, path, {**options, "hotSwapCss": True})
+        with open(path) as f:
+            self.caller.set_stylesheet(f"file:{path}", f.read())
+        self._injected.setdefault(path, set()).add(self.caller)
+        return path
+
+    def __detach__(self, wv: Webview):
+        super().__detach__(wv)
+        for path, watchers in list(self._watchers.items()):
+            watchers.pop(wv, None)
+            if not watchers:
+                self._stop(path)
+        for webviews in self._injected.values():
+            webviews.discard(wv)
+
+    def _stop(self, path):
+        monitor = self._monitors.pop(path, None)
+        self._watchers.pop(path, None)
+        if monitor is not None:
+            monitor.cancel()
+            info("Stopped watching %s", path)
+
+    def _on_changed(self, monitor, gfile, other, event, watched):
+        kind = _KINDS.get(event)
+        if kind is None:
+            return
+        path = gfile.get_path()
+        previous = self._changes.pop((watched, path), None)
+        # Creating then writing a file is still its creation
+        if previous is not None and previous["kind"] == "created" and kind == "changed":
+            kind = "created"
+        self._changes[(watched, path)] = {
+            "path": path,
+            "kind": kind,
+            "to": other.get_path() if kind == "moved" and other is not None else None,
+            "watched": watched,
+        }
+
+        now = GLib.get_monotonic_time() // 1000
+        if self._timer is None:
+            self._first_change = now
+        else:
+            GLib.source_remove(self._timer)
+        delay = min(self.debounce_ms, max(0, self._first_change + self.max_delay_ms - now))
+        self._timer = GLib.timeout_add(delay, self._flush_changes)
+
+    def _flush_changes(self):
+        self._timer = None
+        changes, self._changes = self._changes, {}
+        self._seq += 1
+        reload = set()
+        events = {}  # webview -> its fileChanged events, only for the paths it watches
+        for detail in changes.values():
+            self._apply(detail, reload)
+            event = ["fileChanged", {k: v for k, v in detail.items() if k != "watched"}]
+            for wv in self._watchers.get(detail["watched"], {}):
+                events.setdefault(wv, []).append(event)
+        self.event_stats["emitted"] += len(changes)
+        for wv, wv_events in events.items():
+            self._dispatch(wv_events, [wv])
+        # Once per burst, however many files changed
+        for wv in reload:
+            wv.webview.reload()
+        return GLib.SOURCE_REMOVE
+
+    def _apply(self, detail, reload: set):
+        # Editors often save by renaming a temporary file over the real one
+        path = detail["to"] if detail["kind"] == "moved" else detail["path"]
+        is_css = bool(path) and path.endswith(".css") and detail["kind"] != "deleted"
+        for wv, options in list(self._watchers.get(detail["watched"], {}).items()):
+            if is_css and options.get("hotSwapCss"):
+                self._swap_css(wv, path)
+            elif options.get("reload"):
+                reload.add(wv)
+
+    def _swap_css(self, wv: Webview, path: str):
+        if wv in self._injected.get(path, ()):
+            try:
+                with open(path) as f:
+                    wv.set_stylesheet(f"file:{path}", f.read())
+            except OSError as e:
+                warn(f"Could not re-read {path}: {e}")
+        wv.evaluate(f"{_SWAP_LINKS_JS}({json.dumps(path)}, {self._seq})")
@@ -0,0 +1,21 @@
+from . import Capability, export
+from ..metrics import metrics
+from typing import Dict, Any
+
+
+class MetricsCapability(Capability):
+    """The bridge's own metrics, for widgets that want to display or ship them"""
+
+    @staticmethod
+    def name() -> str:
+        return "metrics"
+
+    @export
+    def snapshot(self, _) -> Dict[str, Any]:
+        """ Returns call counts, error counts and latency histograms per method, events, bytes sent and queue depths. """
+        return metrics.snapshot()
+
+    @export
+    def prometheus(self, _) -> str:
+        """ Returns the same metrics in the prometheus text format. """
+        return metrics.prometheus()
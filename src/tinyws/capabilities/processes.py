@@ -0,0 +1,151 @@
+from typing import Dict, Any, List, Tuple
+import asyncio
+import threading
+import psutil
+from ..utils.logger import info
+from .. import GLib
+from . import export, workers
+from .events import EventCapability
+
+SORT_KEYS = ("cpu", "rss", "pid", "name")
+
+
+class ProcessTableCapability(EventCapability):
+    """A top-like process table.
+
+    Static attributes (name, cmdline, create time) are read once per process, each tick only
+    refreshes cpu and rss. Sampling always runs on the thread pool, one sample at a time. The table is sorted and cut to the top N in python and listeners of
+    `processesChanged` get `{seq, added: [row], removed: [pid], changed: [{pid, cpu, rss}], order: [pid]}`
+    to patch the snapshot returned by `getProcesses()`."""
+
+    @staticmethod
+    def name() -> str:
+        return "processTable"
+
+    def __init__(self):
+        super().__init__()
+        self._procs: Dict[int, psutil.Process] = {}
+        self._static: Dict[Tuple[int, float], Dict[str, Any]] = {}  # (pid, create time) -> attributes
+        self.view: Dict[int, Dict[str, Any]] = {}  # pid -> row, the current top N
+        self.order: List[int] = []
+        self.seq = 0
+        self.sort = "cpu"
+        self.descending = True
+        self.limit = 25
+        self.interval = 2.0
+        self._timer = None
+        self._sampling = False
+        self._lock = threading.Lock()  # A getProcesses() call may sample while a tick does
+
+    @export
+    def configure(self, _, sort: str = "cpu", limit: int = 25, descending: bool = True):
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key '{sort}', expected one of {', '.join(SORT_KEYS)}")
+        self.sort, self.limit, self.descending = sort, int(limit), bool(descending)
+
+    @export
+    async def getProcesses(self, _):
+        if self._timer is None:
+            rows = await asyncio.wrap_future(workers.submit(workers.THREAD, self._sample))
+            self._apply(rows)
+        return {"seq": self.seq, "rows": [self.view[pid] for pid in self.order]}
+
+    @export
+    def startMonitoring(self, _, interval: float = 2.0):
+        self.interval = float(interval)
+        if self._timer is None:
+            self._timer = GLib.timeout_add(int(self.interval * 1000), self._tick)
+            self._tick()
+            info("Started monitoring processes")
+
+    @export
+    def stopMonitoring(self, _):
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+            info("Stopped monitoring processes")
+
+    def _tick(self):
+        # Sampling thousands of processes is too slow for the GTK thread, a tick is skipped if the last one still runs
+        if not self._sampling:
+            self._sampling = True
+            workers.submit(workers.THREAD, self._sample).add_done_callback(
+                lambda f: GLib.idle_add(self._on_sampled, f)
+            )
+        return GLib.SOURCE_CONTINUE
+
+    def __detach__(self, wv):
+        super().__detach__(wv)
+        # The worker pools are shut down with the last webview, a tick would start them again
+        if not self.webviews:
+            self.stopMonitoring(None)
+
+    def _on_sampled(self, future):
+        self._sampling = False
+        if future.cancelled() or self._timer is None:
+            return GLib.SOURCE_REMOVE
+        delta = self._apply(future.result())
+        if delta:
+            self.emit_event(self.wv, "processesChanged", delta)
+        return GLib.SOURCE_REMOVE
+
+    def _static_attrs(self, proc: psutil.Process):
+        with proc.oneshot():
+            return {
+                "name": proc.name(),
+                "cmdline": " ".join(proc.cmdline()),
+                "create_time": proc.create_time(),
+            }
+
+    def _sample(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            pids = set(psutil.pids())
+            for pid in set(self._procs) - pids:
+                del self._procs[pid]
+
+            rows = []
+            alive = set()
+            for pid in pids:
+                try:
+                    proc = self._procs.get(pid)
+                    # The pid may belong to a new process since the last sample
+                    if proc is None or not proc.is_running():
+                        proc = self._procs[pid] = psutil.Process(pid)
+                        # First call only starts the measurement
+                        proc.cpu_percent(None)
+                    key = (pid, proc.create_time())
+                    if key not in self._static:
+                        self._static[key] = self._static_attrs(proc)
+                    alive.add(key)
+                    with proc.oneshot():
+                        rows.append({
+                            "pid": pid,
+                            **self._static[key],
+                            "cpu": round(proc.cpu_percent(None), 1),
+                            "rss": proc.memory_info().rss,
+                        })
+                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                    self._procs.pop(pid, None)
+            for key in set(self._static) - alive:
+                del self._static[key]
+            return rows
+
+    def _apply(self, rows):
+        """Replaces the view with the top N of `rows`, returns the delta or None when nothing changed"""
+        rows.sort(key=lambda row: row[self.sort], reverse=self.descending)
+        top = {row["pid"]: row for row in rows[:self.limit]}
+        order = list(top)
+
+        added = [row for pid, row in top.items() if pid not in self.view]
+        removed = [pid for pid in self.view if pid not in top]
+        changed = [
+            {"pid": pid, "cpu": row["cpu"], "rss": row["rss"]}
+            for pid, row in top.items()
+            if pid in self.view and (self.view[pid]["cpu"], self.view[pid]["rss"]) != (row["cpu"], row["rss"])
+        ]
+        order_changed = order != self.order
+        self.view, self.order = top, order
+        if not (added or removed or changed or order_changed):
+            return None
+        self.seq += 1
+        return {"seq": self.seq, "added": added, "removed": removed, "changed": changed, "order": order}
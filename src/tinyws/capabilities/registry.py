@@ -0,0 +1,111 @@
+from importlib import import_module
+from importlib.metadata import entry_points
+from typing import Callable, Dict, Optional, Union
+from ..utils.logger import info, error
+from .. import Webview
+from . import Capability, ResponseQueue
+from .events import EventCapability
+import traceback
+
+ENTRY_POINT_GROUP = "tinyws.capabilities"
+
+# name -> "module:Class" (relative to this package when it starts with a dot) or a factory
+_registry: Dict[str, Union[str, Callable[[], Capability]]] = {
+    "hello": ".:HelloCapability",
+    "systemInfo": ".sysinfo:SystemInfoCapability",
+    "x11WindowTree": ".x11windowtree:X11WindowTreeCapability",
+    "processTable": ".processes:ProcessTableCapability",
+    "metrics": ".metrics:MetricsCapability",
+    "fileWatch": ".filewatch:FileWatchCapability",
+}
+# Names of the registered EventCapabilities, their placeholders get addEventListener before they are loaded
+_events = {"x11WindowTree", "processTable", "fileWatch"}
+_entry_points_loaded = False
+_lazy: Dict[str, "LazyCapability"] = {}
+
+
+def register(name: str, target: Union[str, Callable[[], Capability]], events: Optional[bool] = None):
+    """Makes a capability available by name, `target` is only imported/called on first use.
+    Pass `events=True` when a "module:Class" target is an EventCapability, a class is checked directly"""
+    _registry[name] = target
+    if events is None:
+        events = isinstance(target, type) and issubclass(target, EventCapability)
+    if events:
+        _events.add(name)
+    else:
+        _events.discard(name)
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        _registry.setdefault(ep.name, ep.value)
+
+
+def create(name: str) -> Capability:
+    _load_entry_points()
+    if name not in _registry:
+        raise KeyError(f"No capability registered as '{name}'")
+    target = _registry[name]
+    if isinstance(target, str):
+        module, _, attr = target.partition(":")
+        target = getattr(import_module(module, package=__package__), attr)
+    return target()
+
+
+class LazyCapability:
+    """Stands in for a registered capability, the page sees it right away but its module is
+    only imported and instantiated when javascript first calls into it"""
+
+    __exported_methods__ = None
+
+    def __init__(self, name: str, events: bool = False):
+        self._name = name
+        self.events = events
+        self.instance: Capability = None
+        self.webviews = []
+
+    def name(self) -> str:
+        return self._name
+
+    def __register__(self, wv: Webview):
+        self.webviews.append(wv)
+        if self.instance is not None:
+            self.instance.__attach__(wv)
+        wv.register_handler(name=self._name, onmessage=lambda v: self.__on_message__(v, wv))
+        info("Capability '%s' was registered, it is loaded on first use", self._name)
+
+    def __detach__(self, wv: Webview):
+        if wv in self.webviews:
+            self.webviews.remove(wv)
+        if self.instance is not None:
+            self.instance.__detach__(wv)
+
+    def __runtime__(self) -> str:
+        # The page may add listeners before the first call loads the capability
+        return EventCapability.__runtime__(self) if self.events else ""
+
+    def __on_message__(self, v, wv: Webview):
+        if self.instance is None:
+            try:
+                instance = create(self._name)
+            except Exception as e:
+                error(traceback.format_exc())
+                ResponseQueue.of(wv).push(self._name, v.get("callbackId"), None, f"Could not load capability '{self._name}': {e}")
+                return
+            for w in self.webviews:
+                instance.__attach__(w)
+            self.instance = instance
+            info("Capability '%s' was successfully loaded!", self._name)
+        self.instance.__on_message__(v, wv)
+
+
+def lazy(name: str) -> LazyCapability:
+    # One instance per name, so webviews in the same process share it
+    if name not in _lazy:
+        _load_entry_points()
+        _lazy[name] = LazyCapability(name, name in _events)
+    return _lazy[name]
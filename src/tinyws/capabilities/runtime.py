@@ -0,0 +1,100 @@
+import json
+from ..binary import MARKER, SCHEME
+
+# Generic client side of the capability RPC, installed once as a document start user script.
+# Only the manifest (capability name -> exported method names) is generated per webview.
+RUNTIME_JS = """
+((manifest) => {
+    // Replies to calls of a previous document may still be on their way, ids must not repeat across documents
+    const documentId = globalThis.crypto?.randomUUID?.() ?? Math.random().toString(36).slice(2);
+    let nextCallbackId = 0;
+    const call = (cap, handler, method) => (...args) => new Promise((resolve, reject) => {
+        const callbackId = `${documentId}:${nextCallbackId++}`;
+        cap.__callbacks[callbackId] = { resolve, reject };
+        handler.postMessage({ method, args, callbackId });
+    });
+    window.__tinyws = {
+        // Asked by python before it converts a large value through JSON, which would turn typed arrays into objects
+        hasBinary: (v) => {
+            const seen = new Set(), todo = [v];
+            while (todo.length) {
+                const x = todo.pop();
+                if (x === null || typeof x !== "object" || seen.has(x)) continue;
+                if (ArrayBuffer.isView(x) || x instanceof ArrayBuffer) return true;
+                seen.add(x);
+                if (typeof x.toJSON !== "function") for (const k in x) todo.push(x[k]);
+            }
+            return false;
+        },
+        // Binary values arrive as a marker, anywhere in the result, the bytes themselves are fetched from the blob scheme
+        decode: async (v) => {
+            if (v === null || typeof v !== "object") return v;
+            if ("%(marker)s" in v) {
+                const buf = await (await fetch(`%(scheme)s://blob/${v.%(marker)s}`)).arrayBuffer();
+                return v.type === "ArrayBuffer" ? buf : new globalThis[v.type](buf);
+            }
+            const keys = Object.keys(v);
+            const values = await Promise.all(keys.map(k => window.__tinyws.decode(v[k])));
+            keys.forEach((k, i) => { v[k] = values[i]; });
+            return v;
+        },
+        // EventTarget backed add/removeEventListener, python is told when a type gains its first or loses its last listener
+        events: (cap) => {
+            const subscribe = cap.addEventListener, unsubscribe = cap.removeEventListener;
+            const listeners = new Map();
+            cap.eventTarget = new EventTarget();
+            cap.addEventListener = (type, listener) => {
+                cap.eventTarget.addEventListener(type, listener);
+                if (!listeners.has(type)) {
+                    listeners.set(type, new Set());
+                    subscribe(type, type);
+                }
+                listeners.get(type).add(listener);
+            };
+            cap.removeEventListener = (type, listener) => {
+                cap.eventTarget.removeEventListener(type, listener);
+                const set = listeners.get(type);
+                if (set && set.delete(listener) && set.size === 0) {
+                    listeners.delete(type);
+                    unsubscribe(type, type);
+                }
+            };
+        },
+    };
+    // Settles a batch of [capability, callbackId, error, result, binary] replies, python only sends the data
+    window.__tinyws_resolve = (replies) => {
+        for (const [name, id, error, result, binary] of replies) {
+            const callbacks = window.capabilities[name]?.__callbacks;
+            const callback = callbacks?.[id];
+            if (!callback) continue;
+            delete callbacks[id];
+            if (error !== null) callback.reject(error); else callback.resolve(binary ? window.__tinyws.decode(result) : result);
+        }
+        return replies.length;
+    };
+    window.capabilities = window.capabilities ?? {};
+    for (const [name, methods] of Object.entries(manifest)) {
+        const cap = { __callbacks: {} };
+        const handler = window.webkit.messageHandlers[name];
+        if (methods === null) {
+            // Lazy capability, python only imports it on the first call so every method name is forwarded
+            window.capabilities[name] = new Proxy(cap, {
+                get: (t, p) => (p in t || typeof p !== "string" || p === "then") ? t[p] : (t[p] = call(t, handler, p)),
+            });
+        } else {
+            for (const method of methods) cap[method] = call(cap, handler, method);
+            window.capabilities[name] = cap;
+        }
+    }
+})(%(manifest)s);
+"""
+
+
+def runtime_script(capabilities) -> str:
+    # Lazy capabilities have no method list yet, they become a forwarding Proxy
+    manifest = {
+        cap.name(): None if cap.__exported_methods__ is None else list(cap.__exported_methods__)
+        for cap in capabilities
+    }
+    extras = "\n".join(cap.__runtime__() for cap in capabilities)
+    return RUNTIME_JS % {"manifest": json.dumps(manifest), "marker": MARKER, "scheme": SCHEME} + extras
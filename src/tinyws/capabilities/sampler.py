@@ -0,0 +1,109 @@
+from array import array
+from typing import Dict, List, Optional
+import threading
+import time
+import os
+import psutil
+
+# Values stored per sample for each metric, cpu has one column per core
+LAYOUT: Dict[str, List[str]] = {
+    "time": ["timestamp"],
+    "cpu": [f"cpu{i}" for i in range(psutil.cpu_count() or 1)],
+    "memory": ["total", "available", "used", "percent"],
+    "disk": ["total", "used", "free", "percent"],
+    "load": ["load1", "load5", "load15"],
+}
+
+
+class Ring:
+    """Fixed size history of samples `width` doubles wide, backed by one flat array"""
+
+    def __init__(self, size: int, width: int):
+        self.size = size
+        self.width = width
+        self.data = array("d", bytes(8 * size * width))
+        self.head = 0  # Next slot to write
+        self.count = 0
+
+    def push(self, values):
+        start = self.head * self.width
+        self.data[start:start + self.width] = array("d", values)
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def latest(self) -> array:
+        start = ((self.head - 1) % self.size) * self.width
+        return self.data[start:start + self.width]
+
+    def last(self, n: int) -> array:
+        """The last `n` samples, oldest first, row after row"""
+        n = max(0, min(n, self.count))
+        start = (self.head - n) % self.size
+        if start + n <= self.size:
+            return self.data[start * self.width:(start + n) * self.width]
+        return self.data[start * self.width:] + self.data[:self.head * self.width]
+
+
+class MetricsSampler:
+    """Samples CPU, memory, disk and load on one background thread, readers only ever touch the rings"""
+
+    def __init__(self, interval: float = 1.0, history: int = 600, disk_path: str = "/"):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.rings = {name: Ring(history, len(fields)) for name, fields in LAYOUT.items()}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self):
+        cpu = psutil.cpu_percent(interval=None, percpu=True)
+        mem = psutil.virtual_memory()
+        disk = psutil.disk_usage(self.disk_path)
+        load = os.getloadavg()
+        with self._lock:
+            self.rings["time"].push([time.time()])
+            self.rings["cpu"].push(cpu)
+            self.rings["memory"].push([mem.total, mem.available, mem.used, mem.percent])
+            self.rings["disk"].push([disk.total, disk.used, disk.free, disk.percent])
+            self.rings["load"].push(load)
+
+    def start(self):
+        # Returns right away, often on the GTK thread, readers get zeros until the first sample is in
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="tinyws-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        # cpu_percent(interval=None) measures since the previous call, prime it so the first sample is meaningful
+        psutil.cpu_percent(interval=None, percpu=True)
+        if self._stop.wait(0.1):
+            return
+        self.sample()
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def latest(self, metric: str) -> array:
+        with self._lock:
+            return self.rings[metric].latest()
+
+    def history(self, metric: str, n: int) -> array:
+        with self._lock:
+            return self.rings[metric].last(n)
+
+
+_sampler: Optional[MetricsSampler] = None
+
+
+def get_sampler(interval: float = 1.0, history: int = 600) -> MetricsSampler:
+    """The process wide sampler, started on first use. The arguments only apply to that first call"""
+    global _sampler
+    if _sampler is None:
+        _sampler = MetricsSampler(interval, history)
+        _sampler.start()
+    return _sampler
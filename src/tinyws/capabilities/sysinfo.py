@@ -1,40 +1,65 @@
-import psutil
 import platform
 from . import Capability, export
+from .sampler import get_sampler, LAYOUT
 from typing import Dict, Any
 
 class SystemInfoCapability(Capability):
+    """System statistics read from the shared background sampler, so they are sampled once
+    per interval however many widgets poll them"""
+
     @staticmethod
     def name() -> str:
         return "systemInfo"
 
+    def __init__(self, interval: float = 1.0, history: int = 600) -> None:
+        super().__init__()
+        self.sampler = get_sampler(interval, history)
+
     @export
     def get_cpu_usage(self, v) -> list[float]:
         """ Returns the CPU usage percentage. """
-        return psutil.cpu_percent(interval=None, percpu=True)
+        return self.sampler.latest("cpu").tolist()
 
     @export
     def get_memory_info(self, v) -> Dict[str, Any]:
         """ Returns memory usage statistics. """
-        mem = psutil.virtual_memory()
+        total, available, used, percent = self.sampler.latest("memory")
         return {
-            "total": mem.total,
-            "available": mem.available,
-            "used": mem.used,
-            "percent": mem.percent
+            "total": int(total),
+            "available": int(available),
+            "used": int(used),
+            "percent": percent
         }
 
     @export
     def get_disk_usage(self, v) -> Dict[str, Any]:
         """ Returns disk usage statistics. """
-        disk = psutil.disk_usage('/')
+        total, used, free, percent = self.sampler.latest("disk")
         return {
-            "total": disk.total,
-            "used": disk.used,
-            "free": disk.free,
-            "percent": disk.percent
+            "total": int(total),
+            "used": int(used),
+            "free": int(free),
+            "percent": percent
         }
 
+    @export
+    def get_load_average(self, v) -> list[float]:
+        """ Returns the 1, 5 and 15 minute load averages. """
+        return self.sampler.latest("load").tolist()
+
+    @export
+    def get_history(self, v, metric: str, n: int = 60):
+        """ Returns the last `n` samples of `metric` as a Float64Array, oldest first,
+        one row of `get_history_layout()[metric]` values per sample. """
+        if metric not in LAYOUT:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {', '.join(LAYOUT)}")
+        return memoryview(self.sampler.history(metric, int(n)))
+
+    @export
+    def get_history_layout(self, v) -> Dict[str, list]:
+        """ Returns the columns of each metric's history. """
+        return LAYOUT
+
     @export
     def get_system_info(self, v) -> Dict[str, str]:
         """ Returns basic system information. """
@@ -0,0 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor, Future
+from typing import Callable, Dict, Optional
+import os
+import multiprocessing
+
+THREAD = "thread"
+PROCESS = "process"
+
+_sizes = {THREAD: min(8, (os.cpu_count() or 1) + 2), PROCESS: os.cpu_count() or 1}
+_pools: Dict[str, Executor] = {}
+
+
+def configure(threads: Optional[int] = None, processes: Optional[int] = None):
+    """Set the worker pool sizes, must be called before the first pooled export runs"""
+    if threads is not None:
+        _sizes[THREAD] = threads
+    if processes is not None:
+        _sizes[PROCESS] = processes
+
+
+def get_pool(kind: str) -> Executor:
+    if kind not in _sizes:
+        raise ValueError(f"Unknown worker pool '{kind}', expected '{THREAD}' or '{PROCESS}'")
+    if kind not in _pools:
+        if kind == THREAD:
+            _pools[kind] = ThreadPoolExecutor(max_workers=_sizes[kind], thread_name_prefix="tinyws")
+        else:
+            # A forked worker would inherit the GTK and GLib state of this process, spawned ones start clean
+            _pools[kind] = ProcessPoolExecutor(max_workers=_sizes[kind], mp_context=multiprocessing.get_context("spawn"))
+    return _pools[kind]
+
+
+def submit(kind: str, fn: Callable, *args) -> Future:
+    return get_pool(kind).submit(fn, *args)
+
+
+def shutdown():
+    """Stops the pools without waiting for running calls, called once the last Webview closed"""
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+    _pools.clear()
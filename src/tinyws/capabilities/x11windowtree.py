@@ -1,15 +1,20 @@
 import Xlib.display
-from Xlib import X
-from Xlib.protocol import event
-import threading
-import time
+import Xlib.error
+from Xlib import X, Xatom
+from Xlib.protocol import event, request
 from typing import Dict, Any
 from ..utils.logger import info
-from .. import Webview
+from .. import Webview, GLib
 from . import Capability, export #, EventCapability
 from .events import EventCapability
 
 class X11WindowTreeCapability(EventCapability):
+    """Top level windows grouped by workspace.
+
+    The tree is kept up to date from X events, listeners of `windowTreeChanged` get
+    `{seq, added: {id: window}, removed: [id], changed: {id: window}}` deltas to patch the
+    snapshot returned by `getWindows()`, `windowTreeUpdated` still carries the whole tree."""
+
     @staticmethod
     def name() -> str:
         return "x11WindowTree"
@@ -18,77 +23,223 @@ class X11WindowTreeCapability(EventCapability):
         super().__init__()
         self.display = Xlib.display.Display()
         self.root = self.display.screen().root
+        # Interned once, every lookup below reuses them
+        self.NET_WM_DESKTOP = self.display.intern_atom('_NET_WM_DESKTOP')
+        self.NET_WM_NAME = self.display.intern_atom('_NET_WM_NAME')
+        self.NET_CLIENT_LIST = self.display.intern_atom('_NET_CLIENT_LIST')
+        self.NET_SUPPORTED = self.display.intern_atom('_NET_SUPPORTED')
+        self.UTF8_STRING = self.display.intern_atom('UTF8_STRING')
+        self.WM_NAME = Xatom.WM_NAME
+        # With an EWMH window manager the managed clients are listed on the root window,
+        # otherwise the top level windows are the root's children
+        supported = self._get_property(self.root.id, self.NET_SUPPORTED, 4096)
+        self.use_client_list = bool(supported) and self.NET_CLIENT_LIST in supported[1]
+        self.windows: Dict[int, Dict[str, Any]] = {}  # window id -> {"name", "workspace"}
+        self.seq = 0
         self.tree = {}
         self.monitoring = False
+        self._watch_source = None
 
     @export
-    def getWindowTree(self):
-        self.update_tree()
+    def getWindowTree(self, _):
+        if not self.monitoring:
+            self.update_tree()
         return self.tree
 
+    @export
+    def getWindows(self, _):
+        """Snapshot the deltas apply to"""
+        if not self.monitoring:
+            self.update_tree()
+        return {"seq": self.seq, "windows": self.windows}
+
     def update_tree(self):
-        self.tree = self._get_window_tree(self.root)
+        self.windows = self._snapshot(self._top_level_ids())
+        self.tree = self._build_tree()
+
+    def _build_tree(self):
+        workspace_windows = {}
+        for window in self.windows.values():
+            names = workspace_windows.setdefault(window["workspace"], [])
+            if window["name"]:
+                names.append(window["name"])
+        return workspace_windows
+
+    # Properties are fetched with deferred requests: all of them are sent first and the replies
+    # collected afterwards, so a snapshot costs about one round trip instead of two per window
 
-    def _get_window_tree(self, window):
+    def _request_property(self, window_id, prop, length=1024):
+        return request.GetProperty(
+            display=self.display.display, defer=True, delete=False, window=window_id,
+            property=prop, type=X.AnyPropertyType, long_offset=0, long_length=length,
+        )
+
+    @staticmethod
+    def _reply(req):
+        """(type, value) of a deferred GetProperty, None when unset. Raises BadWindow when the window is gone"""
         try:
-            children = window.query_tree().children
-            if not children:
-                return None
-
-            workspace_windows = {}
-            for child in children:
-                try:
-                    workspace = self._get_window_workspace(child)
-                    if workspace not in workspace_windows:
-                        workspace_windows[workspace] = []
-                    window_name = self._get_window_name(child)
-                    if window_name:
-                        workspace_windows[workspace].append(window_name)
-                except Xlib.error.BadWindow:
-                    continue
-
-            return workspace_windows
-        except Xlib.error.BadWindow:
+            req.reply()
+        except Xlib.error.BadAtom:
+            return None
+        if not req.property_type:
             return None
+        return req.property_type, req.value[1]
 
-    def _get_window_workspace(self, window):
+    def _get_property(self, window_id, prop, length=1024):
+        return self._reply(self._request_property(window_id, prop, length))
+
+    def _top_level_ids(self):
+        if self.use_client_list:
+            clients = self._get_property(self.root.id, self.NET_CLIENT_LIST, 65536)
+            return list(clients[1]) if clients else []
         try:
-            workspace = window.get_full_property(self.display.intern_atom('_NET_WM_DESKTOP'), 0)
-            if workspace:
-                return f"Workspace {workspace.value[0] + 1}"
-            return "Unknown Workspace"
+            return [child.id for child in self.root.query_tree().children]
         except Xlib.error.BadWindow:
-            return "Unknown Workspace"
+            return []
+
+    def _snapshot(self, window_ids):
+        pending = [
+            (
+                window_id,
+                self._request_property(window_id, self.NET_WM_NAME),
+                self._request_property(window_id, self.WM_NAME),
+                self._request_property(window_id, self.NET_WM_DESKTOP, 1),
+            )
+            for window_id in window_ids
+        ]
+        self.display.flush()
+
+        windows = {}
+        for window_id, net_name, name, desktop in pending:
+            try:
+                net_name, name, desktop = self._reply(net_name), self._reply(name), self._reply(desktop)
+            except Xlib.error.BadWindow:
+                continue
+            windows[window_id] = {
+                "name": self._decode_name(net_name) or self._decode_name(name),
+                "workspace": f"Workspace {desktop[1][0] + 1}" if desktop and len(desktop[1]) else "Unknown Workspace",
+            }
+        return windows
 
-    def _get_window_name(self, window):
+    def _decode_name(self, prop):
+        if not prop or not isinstance(prop[1], bytes):
+            return None
+        prop_type, value = prop
+        return value.decode("utf-8" if prop_type == self.UTF8_STRING else "latin-1", "replace") or None
+
+    def _get_window_info(self, window):
+        return self._snapshot([window.id]).get(window.id)
+
+    def _watch(self, window):
         try:
-            name = window.get_wm_name()
-            return name if name else None
+            window.change_attributes(event_mask=X.PropertyChangeMask)
         except Xlib.error.BadWindow:
-            return None
+            pass
+
+    def _add(self, window, delta):
+        if window.id in self.windows:
+            return
+        props = self._get_window_info(window)
+        if props is not None:
+            self._insert(window, props, delta)
+
+    def _insert(self, window, props, delta):
+        self._watch(window)
+        self.windows[window.id] = props
+        if window.id in delta["removed"]:
+            delta["removed"].remove(window.id)
+            delta["changed"][window.id] = props
+        else:
+            delta["added"][window.id] = props
+
+    def _remove(self, window_id, delta):
+        if self.windows.pop(window_id, None) is None:
+            return
+        delta["changed"].pop(window_id, None)
+        if delta["added"].pop(window_id, None) is None:
+            delta["removed"].append(window_id)
+
+    def _sync_client_list(self, delta):
+        clients = set(self._top_level_ids())
+        for window_id in set(self.windows) - clients:
+            self._remove(window_id, delta)
+        for window_id, props in self._snapshot(clients - set(self.windows)).items():
+            self._insert(self.display.create_resource_object("window", window_id), props, delta)
+
+    def _handle_event(self, e, delta):
+        if isinstance(e, event.PropertyNotify) and e.window == self.root:
+            if e.atom == self.NET_CLIENT_LIST and self.use_client_list:
+                self._sync_client_list(delta)
+        elif isinstance(e, event.DestroyNotify):
+            self._remove(e.window.id, delta)
+        elif self.use_client_list:
+            # Root children are frames of the window manager, clients come and go with _NET_CLIENT_LIST
+            pass
+        elif isinstance(e, event.CreateNotify) and e.parent == self.root:
+            self._add(e.window, delta)
+        elif isinstance(e, event.ReparentNotify):
+            if e.parent == self.root:
+                self._add(e.window, delta)
+            else:
+                self._remove(e.window.id, delta)
+
+        if isinstance(e, event.PropertyNotify) and e.window.id in self.windows:
+            if e.atom not in (self.NET_WM_DESKTOP, self.WM_NAME, self.NET_WM_NAME):
+                return
+            window = self.windows[e.window.id]
+            window.update(self._get_window_info(e.window) or {})
+            if e.window.id not in delta["added"]:
+                delta["changed"][e.window.id] = window
+
+    def _emit_delta(self, delta):
+        if not (delta["added"] or delta["removed"] or delta["changed"]):
+            return
+        self.seq += 1
+        self.tree = self._build_tree()
+        self.emit_event(self.wv, "windowTreeChanged", {"seq": self.seq, **delta})
+        if self.has_listeners("windowTreeUpdated"):
+            self.emit_event(self.wv, "windowTreeUpdated", {"tree": self.tree})
+
+    @staticmethod
+    def _new_delta():
+        return {"added": {}, "removed": [], "changed": {}}
 
     @export
-    def startMonitoring(self, wv: Webview):
+    def startMonitoring(self, _):
         if not self.monitoring:
             self.monitoring = True
-            threading.Thread(target=self._monitor_changes, args=(wv,), daemon=True).start()
+            self.root.change_attributes(event_mask=X.SubstructureNotifyMask | X.PropertyChangeMask)
+            self.update_tree()
+            for window_id in self.windows:
+                self._watch(self.display.create_resource_object("window", window_id))
+            self.display.flush()
+            # Events are handled on the GTK main loop as soon as the X connection has data, no thread needed
+            self._watch_source = GLib.io_add_watch(
+                self.display.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._on_x_data
+            )
+            self._drain()
             info("Started monitoring X11 window changes")
 
     @export
-    def stopMonitoring(self):
+    def stopMonitoring(self, _):
         self.monitoring = False
+        if self._watch_source is not None:
+            GLib.source_remove(self._watch_source)
+            self._watch_source = None
         info("Stopped monitoring X11 window changes")
 
-    def _monitor_changes(self, wv: Webview):
-        self.root.change_attributes(event_mask=X.SubstructureNotifyMask)
-        while self.monitoring:
-            event = self.display.next_event()
-            if isinstance(event, (Xlib.protocol.event.CreateNotify, Xlib.protocol.event.DestroyNotify)):
-                self.update_tree()
-                self.emit_event(wv, "windowTreeUpdated", {"tree": self.tree})
-            time.sleep(0.1)  # Prevent high CPU usage
-
-    def register(self, wv: Webview):
-        super().register(wv)
-        # Additional setup if needed
-        info(f"X11WindowTreeCapability registered successfully!")
+    def _on_x_data(self, fd, condition):
+        if condition & (GLib.IO_HUP | GLib.IO_ERR):
+            self.monitoring = False
+            self._watch_source = None
+            info("X11 connection closed, stopped monitoring window changes")
+            return GLib.SOURCE_REMOVE
+        self._drain()
+        return GLib.SOURCE_CONTINUE
+
+    def _drain(self):
+        # Everything already received, including events queued while waiting for property replies, becomes one delta
+        delta = self._new_delta()
+        while self.display.pending_events():
+            self._handle_event(self.display.next_event(), delta)
+        self._emit_delta(delta)
@@ -0,0 +1,58 @@
+import dataclasses
+import datetime
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(o):
+    """Everything JSON does not know natively, NumPy is duck typed so it is never imported here"""
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+        return o.isoformat()
+    if hasattr(o, "__array_interface__") or hasattr(o, "dtype"):
+        return o.tolist()  # arrays and numpy scalars
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    if isinstance(o, (bytes, bytearray, memoryview)):
+        return list(bytes(o))
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class JSONEncoder:
+    """The standard library, always available"""
+    name = "json"
+
+    def encode(self, obj) -> str:
+        return json.dumps(obj, default=default, separators=(",", ":"))
+
+
+class OrjsonEncoder:
+    """Several times faster, handles NumPy arrays, dataclasses and datetimes itself"""
+    name = "orjson"
+
+    def encode(self, obj) -> str:
+        return orjson.dumps(
+            obj, default=default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+
+ENCODERS = {"json": JSONEncoder}
+if orjson is not None:
+    ENCODERS["orjson"] = OrjsonEncoder
+
+
+def get_encoder(encoder=None):
+    """`encoder` is a name from ENCODERS, an object with `encode(obj) -> str` or None for the standard library.
+    orjson is opt-in, it turns NaN into null and refuses integers wider than 64 bits"""
+    if encoder is None:
+        encoder = "json"
+    if isinstance(encoder, str):
+        if encoder not in ENCODERS:
+            raise ValueError(f"Unknown encoder '{encoder}', available: {', '.join(ENCODERS)}")
+        return ENCODERS[encoder]()
+    return encoder
@@ -0,0 +1,96 @@
+import ctypes
+import math
+from gi.repository import JavaScriptCore  # type: ignore
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Values with more nodes than this go through to_json() and one (fast) JSON parse instead,
+# every node of the direct walk costs a few GObject calls. Values holding typed arrays are
+# always walked, so binary data arrives as bytes/memoryview whatever the size of the message
+WALK_BUDGET = 64
+
+_HAS_TYPED_ARRAYS = hasattr(JavaScriptCore.Value, "is_typed_array")
+_TYPED_ARRAY_FORMATS = {}
+if _HAS_TYPED_ARRAYS:
+    _t = JavaScriptCore.TypedArrayType
+    _TYPED_ARRAY_FORMATS = {
+        _t.INT8: "b", _t.INT16: "h", _t.INT32: "i", _t.INT64: "q",
+        _t.UINT8: "B", _t.UINT8_CLAMPED: "B", _t.UINT16: "H", _t.UINT32: "I", _t.UINT64: "Q",
+        _t.FLOAT32: "f", _t.FLOAT64: "d",
+    }
+
+
+class _UseJSON(Exception):
+    pass
+
+
+def jsv_to_primitive(v: JavaScriptCore.Value):
+    if v.is_undefined() or v.is_null():
+        return None
+    if v.is_function():
+        return lambda *args: jsv_to_primitive(v.function_call(*(JavaScriptCore.Value.new_from_json(arg) for arg in args)))
+    try:
+        return _walk(v, [WALK_BUDGET])
+    except _UseJSON:
+        if _HAS_TYPED_ARRAYS and _has_binary(v):
+            return _walk(v, [math.inf])
+        return json_loads(v.to_json(0))
+
+
+def _has_binary(v: JavaScriptCore.Value) -> bool:
+    # One call into the page's runtime instead of a node by node walk from python
+    tinyws = v.get_context().get_value("__tinyws")
+    if not tinyws.is_object() or not tinyws.object_has_property("hasBinary"):
+        return True
+    return tinyws.object_invoke_method_with_values("hasBinary", [v]).to_boolean()
+
+
+def _walk(v: JavaScriptCore.Value, budget):
+    """Same result as json.loads(v.to_json(0)) for plain data, typed arrays become memoryview/bytes"""
+    budget[0] -= 1
+    if budget[0] < 0:
+        raise _UseJSON()
+    if v.is_undefined() or v.is_null():
+        return None
+    if v.is_boolean():
+        return v.to_boolean()
+    if v.is_number():
+        d = v.to_double()
+        if not math.isfinite(d):
+            return None
+        return int(d) if d.is_integer() and abs(d) < 2 ** 53 else d
+    if v.is_string():
+        return v.to_string()
+    if _HAS_TYPED_ARRAYS and v.is_typed_array():
+        return _typed_array(v)
+    if _HAS_TYPED_ARRAYS and v.is_array_buffer():
+        return _copy(v.array_buffer_get_data(), v.array_buffer_get_size())
+    if v.is_array():
+        return [_walk(v.object_get_property_at_index(i), budget) for i in range(v.object_get_property("length").to_int32())]
+    if v.is_object():
+        # Dates and the like serialize themselves
+        if v.object_has_property("toJSON"):
+            return json_loads(v.to_json(0))
+        result = {}
+        for k in v.object_enumerate_properties() or []:
+            prop = v.object_get_property(k)
+            if not (prop.is_undefined() or prop.is_function()):
+                result[k] = _walk(prop, budget)
+        return result
+    return json_loads(v.to_json(0))
+
+
+def _copy(ptr, size) -> bytes:
+    # The data getters return the pointer along with the length out argument
+    if isinstance(ptr, tuple):
+        ptr = ptr[0]
+    return ctypes.string_at(ptr, size) if ptr and size else b""
+
+
+def _typed_array(v: JavaScriptCore.Value):
+    fmt = _TYPED_ARRAY_FORMATS.get(v.typed_array_get_type(), "B")
+    data = _copy(v.typed_array_get_data(), v.typed_array_get_size())
+    return data if fmt == "B" else memoryview(data).cast(fmt)
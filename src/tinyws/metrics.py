@@ -0,0 +1,196 @@
+import os
+import stat
+import atexit
+import bisect
+from collections import defaultdict
+from .utils.logger import info, warn
+from gi.repository import Gio, GLib  # type: ignore
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+
+def _label(value) -> str:
+    # Capability, method and event names come from pages and plugins, they must not break the exposition format
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def message_size(v) -> int:
+    """Roughly the JSON size of a message from javascript, binary values count their bytes"""
+    if isinstance(v, str):
+        return len(v) + 2
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return memoryview(v).nbytes
+    if isinstance(v, dict):
+        return 2 + sum(len(k) + 4 + message_size(x) for k, x in v.items())
+    if isinstance(v, (list, tuple)):
+        return 2 + sum(1 + message_size(x) for x in v)
+    return len(str(v))
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.sum += ms
+        self.count += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum_ms": self.sum,
+            "buckets": {("+Inf" if b == float("inf") else str(b)): c for b, c in zip(BUCKETS_MS, self.counts)},
+        }
+
+
+class Metrics:
+    """Process wide bridge counters, cheap enough to stay on in production"""
+
+    def __init__(self):
+        self.calls = defaultdict(int)  # (capability, method) -> calls
+        self.errors = defaultdict(int)  # (capability, method) -> failed calls
+        self.latency = defaultdict(Histogram)  # (capability, method) -> call to reply time
+        self.in_flight = defaultdict(int)  # capability -> calls without a reply yet
+        self.events = defaultdict(int)  # (capability, event type) -> dispatched events
+        self.bytes_out = defaultdict(int)  # channel -> bytes sent to javascript
+        self.messages_in = defaultdict(int)  # message handler -> messages received from javascript
+        self.bytes_in = defaultdict(int)  # message handler -> their size, see message_size()
+        self._server = None
+        self._path = None
+
+    def call_started(self, capability, method):
+        self.calls[(capability, method)] += 1
+        self.in_flight[capability] += 1
+
+    def call_finished(self, capability, method, ms, failed=False):
+        self.in_flight[capability] -= 1
+        self.latency[(capability, method)].observe(ms)
+        if failed:
+            self.errors[(capability, method)] += 1
+
+    def event_dispatched(self, capability, event_type, count=1):
+        self.events[(capability, event_type)] += count
+
+    def sent(self, channel, nbytes):
+        self.bytes_out[channel] += nbytes
+
+    def received(self, channel, nbytes):
+        self.messages_in[channel] += 1
+        self.bytes_in[channel] += nbytes
+
+    def gauges(self):
+        from . import Webview
+
+        webviews = list(Webview._open)
+        return {
+            "webviews": len(webviews),
+            "pending_evaluations": sum(len(wv._evaluate_list) for wv in webviews),
+            "queued_replies": sum(len(wv.responses._pending) for wv in webviews if wv.responses),
+            "blobs_waiting": sum(len(store._blobs) for store in Webview._blob_stores.values()),
+        }
+
+    def snapshot(self):
+        return {
+            "methods": [
+                {
+                    "capability": cap,
+                    "method": method,
+                    "calls": calls,
+                    "errors": self.errors[(cap, method)],
+                    "latency": self.latency[(cap, method)].to_dict(),
+                }
+                for (cap, method), calls in self.calls.items()
+            ],
+            "in_flight": dict(self.in_flight),
+            "events": [{"capability": cap, "type": t, "count": n} for (cap, t), n in self.events.items()],
+            "bytes_out": dict(self.bytes_out),
+            "messages_in": dict(self.messages_in),
+            "bytes_in": dict(self.bytes_in),
+            **self.gauges(),
+        }
+
+    def prometheus(self) -> str:
+        lines = [
+            "# TYPE tinyws_calls_total counter",
+            *(f'tinyws_calls_total{{capability="{_label(c)}",method="{_label(m)}"}} {n}' for (c, m), n in self.calls.items()),
+            "# TYPE tinyws_errors_total counter",
+            *(f'tinyws_errors_total{{capability="{_label(c)}",method="{_label(m)}"}} {n}' for (c, m), n in self.errors.items()),
+            "# TYPE tinyws_call_latency_ms histogram",
+        ]
+        for (c, m), h in self.latency.items():
+            labels = f'capability="{_label(c)}",method="{_label(m)}"'
+            total = 0
+            for bound, count in zip(BUCKETS_MS, h.counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else bound
+                lines.append(f'tinyws_call_latency_ms_bucket{{{labels},le="{le}"}} {total}')
+            lines.append(f"tinyws_call_latency_ms_sum{{{labels}}} {h.sum}")
+            lines.append(f"tinyws_call_latency_ms_count{{{labels}}} {h.count}")
+        lines += [
+            "# TYPE tinyws_in_flight gauge",
+            *(f'tinyws_in_flight{{capability="{_label(c)}"}} {n}' for c, n in self.in_flight.items()),
+            "# TYPE tinyws_events_total counter",
+            *(f'tinyws_events_total{{capability="{_label(c)}",type="{_label(t)}"}} {n}' for (c, t), n in self.events.items()),
+            "# TYPE tinyws_bytes_out_total counter",
+            *(f'tinyws_bytes_out_total{{channel="{_label(ch)}"}} {n}' for ch, n in self.bytes_out.items()),
+            "# TYPE tinyws_messages_in_total counter",
+            *(f'tinyws_messages_in_total{{channel="{_label(ch)}"}} {n}' for ch, n in self.messages_in.items()),
+            "# TYPE tinyws_bytes_in_total counter",
+            *(f'tinyws_bytes_in_total{{channel="{_label(ch)}"}} {n}' for ch, n in self.bytes_in.items()),
+        ]
+        for name, value in self.gauges().items():
+            lines += [f"# TYPE tinyws_{name} gauge", f"tinyws_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, path: str):
+        """Writes the prometheus dump to every client connecting to the unix socket at `path`"""
+        if self._server is not None:
+            return
+        if os.path.lexists(path):
+            # Only a stale socket of a previous run is replaced, never a file given by mistake
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                warn(f"Not serving metrics on {path}: it exists and is not a socket")
+                return
+            os.unlink(path)
+        self._server = Gio.SocketService.new()
+        try:
+            self._server.add_address(
+                Gio.UnixSocketAddress.new(path), Gio.SocketType.STREAM, Gio.SocketProtocol.DEFAULT, None
+            )
+        except GLib.Error as err:
+            warn(f"Could not serve metrics on {path}: {err.message}")
+            self._server = None
+            return
+        self._server.connect("incoming", self._on_incoming)
+        self._server.start()
+        self._path = path
+        atexit.register(self.close)
+        info(f"Serving metrics on {path}")
+
+    def close(self):
+        """Stops serving and removes the socket, run at exit"""
+        if self._server is None:
+            return
+        self._server.stop()
+        self._server.close()
+        self._server = None
+        try:
+            if stat.S_ISSOCK(os.lstat(self._path).st_mode):
+                os.unlink(self._path)
+        except OSError:
+            pass
+
+    def _on_incoming(self, service, connection, source):
+        try:
+            connection.get_output_stream().write_all(self.prometheus().encode(), None)
+        except GLib.Error as err:
+            warn(f"Could not send metrics: {err.message}")
+        connection.close(None)
+        return True
+
+
+metrics = Metrics()
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+from .utils.logger import warn, info
+from gi.repository import WebKit2  # type: ignore
+
+
+class Profile:
+    """WebKit memory and process settings applied when a widget's WebContext is created.
+    None leaves WebKit's default in place"""
+
+    def __init__(
+        self,
+        name,
+        cache_model=None,
+        process_limit=None,
+        memory_limit_mb=None,
+        webgl=None,
+        media=None,
+        webaudio=None,
+        page_cache=None,
+        smooth_scrolling=None,
+        hardware_acceleration=None,
+    ):
+        self.name = name
+        self.cache_model = cache_model  # WebKit2.CacheModel member name
+        self.process_limit = process_limit
+        self.memory_limit_mb = memory_limit_mb
+        self.webgl = webgl
+        self.media = media
+        self.webaudio = webaudio
+        self.page_cache = page_cache
+        self.smooth_scrolling = smooth_scrolling
+        self.hardware_acceleration = hardware_acceleration  # WebKit2.HardwareAccelerationPolicy member name
+
+    def create_context(self, ephemeral=True) -> WebKit2.WebContext:
+        props = {}
+        if ephemeral:
+            props["website_data_manager"] = WebKit2.WebsiteDataManager.new_ephemeral()
+        if self.memory_limit_mb is not None:
+            if hasattr(WebKit2, "MemoryPressureSettings"):
+                mps = WebKit2.MemoryPressureSettings.new()
+                mps.set_memory_limit(self.memory_limit_mb)
+                props["memory_pressure_settings"] = mps
+            else:
+                warn(f"Profile '{self.name}': memory pressure settings need WebKit2GTK 2.34")
+        ctx = WebKit2.WebContext(**props)
+
+        if self.cache_model is not None:
+            ctx.set_cache_model(getattr(WebKit2.CacheModel, self.cache_model))
+        if self.process_limit is not None:
+            # Both deprecated in newer WebKit2GTK, which always uses one process per view
+            if self.process_limit == 1 and hasattr(ctx, "set_process_model"):
+                ctx.set_process_model(WebKit2.ProcessModel.SHARED_SECONDARY_PROCESS)
+            _set(ctx, "web_process_count_limit", self.process_limit)
+        return ctx
+
+    def apply_settings(self, cfg: WebKit2.Settings):
+        _set(cfg, "enable_webgl", self.webgl)
+        _set(cfg, "enable_media", self.media)
+        _set(cfg, "enable_webaudio", self.webaudio)
+        _set(cfg, "enable_page_cache", self.page_cache)
+        _set(cfg, "enable_smooth_scrolling", self.smooth_scrolling)
+        if self.hardware_acceleration is not None:
+            _set(cfg, "hardware_acceleration_policy", getattr(WebKit2.HardwareAccelerationPolicy, self.hardware_acceleration))
+
+
+def _set(obj, prop, value):
+    if value is None:
+        return
+    setter = getattr(obj, f"set_{prop}", None)
+    if setter is None:
+        warn(f"This WebKit2GTK version does not support '{prop}', ignoring it")
+        return
+    setter(value)
+
+
+PROFILES = {
+    # Tiny mostly static widgets, everything not needed for some HTML and CSS is off
+    "widget": Profile(
+        "widget",
+        cache_model="DOCUMENT_VIEWER",
+        process_limit=1,
+        memory_limit_mb=128,
+        webgl=False,
+        media=False,
+        webaudio=False,
+        page_cache=False,
+        smooth_scrolling=False,
+    ),
+    # Live charts and canvases, keeps WebGL
+    "dashboard": Profile(
+        "dashboard",
+        cache_model="DOCUMENT_VIEWER",
+        process_limit=2,
+        memory_limit_mb=256,
+        media=False,
+        webaudio=False,
+        page_cache=False,
+    ),
+    # WebKit defaults, for widgets that show arbitrary websites
+    "browser": Profile("browser", cache_model="WEB_BROWSER"),
+}
+
+
+def get_profile(profile) -> Profile:
+    if profile is None or isinstance(profile, Profile):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile '{profile}', expected one of {', '.join(PROFILES)}")
+    return PROFILES[profile]
+
+
+def measure_rss(pid=None) -> int:
+    """RSS in bytes of a process and all of its descendants (the WebKit web and network processes)"""
+    pid = pid or os.getpid()
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+
+    page = os.sysconf("SC_PAGE_SIZE")
+    total, todo = 0, [pid]
+    while todo:
+        p = todo.pop()
+        try:
+            with open(f"/proc/{p}/statm") as f:
+                total += int(f.read().split()[1]) * page
+        except (OSError, IndexError, ValueError):
+            pass
+        todo.extend(children.get(p, []))
+    return total
+
+
+def _probe(profile, url, settle, count):
+    from . import Webview, GLib
+
+    widgets = [
+        Webview(url=url, profile=profile, shared_context=True, exit_on_window_close=False, width=300, height=200)
+        for _ in range(count)
+    ]
+
+    def report():
+        print(json.dumps({"profile": profile or "default", "rss": measure_rss()}), flush=True)
+        # The loop only stops once every widget is gone
+        for wv in widgets:
+            wv.__cleanup__()
+        return GLib.SOURCE_REMOVE
+
+    GLib.timeout_add_seconds(settle, report)
+    widgets[0].run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the RSS of the profile presets against WebKit's defaults")
+    parser.add_argument("--url", default="about:blank", help="Page every widget loads")
+    parser.add_argument("--count", default=4, type=int, help="Widgets per process")
+    parser.add_argument("--settle", default=5, type=int, help="Seconds to wait before measuring")
+    parser.add_argument("--timeout", default=30, type=int, help="Seconds a probe may take on top of --settle")
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        _probe(None if args.probe == "default" else args.probe, args.url, args.settle, args.count)
+        return
+
+    results = {}
+    for name in ["default", *PROFILES]:
+        try:
+            out = subprocess.run(
+                [sys.executable, "-m", __spec__.name, "--probe", name, "--url", args.url,
+                 "--settle", str(args.settle), "--count", str(args.count)],
+                capture_output=True, text=True, timeout=args.settle + args.timeout,
+            ).stdout.strip().splitlines()
+        except subprocess.TimeoutExpired as e:
+            warn(f"{name}: probe did not exit within {args.settle + args.timeout}s")
+            # Always bytes here, whatever text= says
+            out = (e.stdout or b"").decode(errors="replace").strip().splitlines()
+        results[name] = json.loads(out[-1])["rss"] if out else None
+        info(f"{name}: {results[name]} bytes")
+
+    baseline = results["default"]
+    print(json.dumps({
+        name: {"rss": rss, "saved": baseline - rss if baseline and rss else None}
+        for name, rss in results.items()
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import re
+import json
+import time
+import cProfile
+import tracemalloc
+from typing import Dict, Any
+from .utils.logger import info, warn
+
+
+class Profiler:
+    """Opt-in per hook profiles: every capability method, `evaluate()` and onload listener gets its
+    own cProfile stats, wall time and (with `memory=True`) tracemalloc allocation totals.
+
+    Only the part running on the GTK thread is measured, which is the part that costs frames:
+    pooled exports are measured up to their submission and async ones up to their first await.
+    `dump()` writes `<key>.prof` files (open with `pstats` or snakeviz) and a `summary.json`"""
+
+    def __init__(self, directory: str, memory: bool = False, memory_frames: int = 8):
+        self.directory = directory
+        self.memory = memory
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._active = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(memory_frames)
+
+    def call(self, key: str, fn, *args):
+        # Nested hooks (an export calling evaluate()) count towards the outer one, cProfile can't nest
+        if self._active:
+            return fn(*args)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = {"calls": 0, "wall_ms": 0.0, "max_ms": 0.0, "alloc_bytes": 0, "peak_bytes": 0}
+        profile = self._profiles.get(key)
+        if profile is None:
+            profile = self._profiles[key] = cProfile.Profile()
+
+        if self.memory:
+            tracemalloc.reset_peak()
+            mem_before = tracemalloc.get_traced_memory()[0]
+        self._active = True
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler owns the interpreter, keep the timings at least
+            profile = None
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            if profile is not None:
+                profile.disable()
+            self._active = False
+            stats["calls"] += 1
+            stats["wall_ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+            if self.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                stats["alloc_bytes"] += current - mem_before
+                stats["peak_bytes"] = max(stats["peak_bytes"], peak - mem_before)
+
+    def dump(self):
+        if not self._stats:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for key, profile in self._profiles.items():
+                if self._stats[key]["calls"]:
+                    profile.dump_stats(os.path.join(self.directory, _file_name(key) + ".prof"))
+            summary = sorted(
+                ({"key": key, **stats} for key, stats in self._stats.items()),
+                key=lambda s: s["wall_ms"],
+                reverse=True,
+            )
+            with open(os.path.join(self.directory, "summary.json"), "w") as f:
+                json.dump(summary, f, indent=2)
+            if self.memory:
+                top = tracemalloc.take_snapshot().statistics("lineno")[:50]
+                with open(os.path.join(self.directory, "memory.txt"), "w") as f:
+                    f.write("\n".join(str(stat) for stat in top) + "\n")
+        except OSError as e:
+            warn(f"Could not write profiles to {self.directory}: {e}")
+            return
+        info(f"Wrote profiles of {len(self._stats)} hooks to {self.directory}")
+
+
+_profilers: Dict[str, Profiler] = {}
+
+
+def get_profiler(profiling) -> Profiler:
+    """`profiling` is a directory or a Profiler, widgets given the same directory share one Profiler"""
+    if profiling is None or isinstance(profiling, Profiler):
+        return profiling
+    directory = os.path.abspath(profiling)
+    if directory not in _profilers:
+        _profilers[directory] = Profiler(directory)
+    return _profilers[directory]
+
+
+def hook_name(fn) -> str:
+    """A readable key for callbacks, lambdas are told apart by where they were defined"""
+    name = getattr(fn, "__qualname__", None) or repr(fn)
+    code = getattr(fn, "__code__", None)
+    if "<lambda>" in name and code is not None:
+        name += f"@{os.path.basename(code.co_filename)}:{code.co_firstlineno}"
+    return name
+
+
+def _file_name(key: str) -> str:
+    return re.sub(r"[^\w.@-]+", "_", key)
@@ -0,0 +1,200 @@
+import os
+import gi
+import time
+import cairo
+import hashlib
+from urllib.parse import urlsplit, unquote
+from .utils.logger import info, warn
+
+# get_snapshot() hands back a cairo surface
+gi.require_foreign("cairo")
+
+from gi.repository import Gtk, WebKit2, GLib  # type: ignore # noqa: E402
+
+# Pages often paint once more right after load, wait this long before taking the picture
+SETTLE_MS = 250
+# Resizes are followed by a re-render once the size stopped changing for this long
+RESIZE_DEBOUNCE_MS = 300
+# The cache directory keeps the most recently shown pictures, older ones are deleted when a new one is written
+MAX_CACHED = 256
+MAX_AGE_S = 30 * 24 * 3600
+
+
+def cache_dir() -> str:
+    return os.path.join(GLib.get_user_cache_dir(), "tinyws", "snapshots")
+
+
+class Snapshotter:
+    """Snapshot mode of a Webview, for static widgets.
+
+    The page is rendered once, pictured with `WebView.get_snapshot()` and from then on shown as a plain
+    Gtk.Image while its web process is terminated. Snapshots are cached on disk, keyed by a hash of the
+    content, the size and the scale factor, so a widget started again with the same page doesn't load it
+    at all. The page is rendered again when the window is resized, every `interval` seconds (0 disables)
+    or when `invalidate()` is called, e.g. after an asset it references changed.
+
+    For `html=` the content is the document itself and for `file://` URLs the file's mtime and size.
+    Other URLs can't be checked without loading them, their pictures only go stale through `interval`
+    or `invalidate()`"""
+
+    def __init__(self, wv, content: str, load, interval: float = 0, transparent=False, directory: str = None):
+        self.wv = wv
+        self.content = content
+        self.load = load  # Loads the page into wv.webview
+        self.transparent = transparent
+        self.directory = directory or cache_dir()
+        self.size = None  # (width, height) of the picture being shown
+        self.rendering = False
+        self._settle = None
+        self._resize = None
+        self._interval = None
+
+        self.image = Gtk.Image()
+        self.stack = Gtk.Stack()
+        self.stack.add_named(wv.webview, "live")
+        self.stack.add_named(self.image, "snapshot")
+        self.stack.connect("size-allocate", self._on_size_allocate)
+        wv.webview.connect("load-changed", self._on_load_changed)
+        if interval > 0:
+            self._interval = GLib.timeout_add(int(interval * 1000), self._on_interval)
+
+    def key(self, width: int, height: int) -> str:
+        scale = self.wv.window.get_scale_factor()
+        source = f"{self.content}\0{self._version()}\0{width}x{height}@{scale}\0{self.transparent}"
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def _version(self) -> str:
+        url = urlsplit(self.content)
+        if url.scheme != "file":
+            return ""
+        try:
+            st = os.stat(unquote(url.path))
+        except OSError:
+            return ""
+        return f"{st.st_mtime_ns}:{st.st_size}"
+
+    def path(self, width: int, height: int) -> str:
+        return os.path.join(self.directory, self.key(width, height) + ".png")
+
+    def start(self, width: int, height: int):
+        """Shows the cached picture for this size if there is one, loads the page otherwise.
+        Called with the first allocation, the size isn't known before"""
+        if not self._show(width, height):
+            self.render()
+
+    def render(self):
+        if self.rendering:
+            return
+        self.rendering = True
+        self.stack.set_visible_child_name("live")
+        # Starts a new web process when the last one was terminated
+        self.load()
+
+    def invalidate(self):
+        """Drops the cached picture of the current size and renders the page again"""
+        if self.size:
+            try:
+                os.unlink(self.path(*self.size))
+            except FileNotFoundError:
+                pass
+        self.render()
+
+    def stop(self):
+        """Removes the pending timers, called when the window closes"""
+        for source in (self._interval, self._settle, self._resize):
+            if source is not None:
+                GLib.source_remove(source)
+        self._interval = self._settle = self._resize = None
+
+    def _on_interval(self):
+        self.render()
+        return GLib.SOURCE_CONTINUE
+
+    def _on_load_changed(self, webview, evt):
+        if evt == WebKit2.LoadEvent.FINISHED and self.rendering:
+            if self._settle is not None:
+                GLib.source_remove(self._settle)
+            self._settle = GLib.timeout_add(SETTLE_MS, self._take)
+
+    def _take(self):
+        self._settle = None
+        options = WebKit2.SnapshotOptions.TRANSPARENT_BACKGROUND if self.transparent else WebKit2.SnapshotOptions.NONE
+        self.wv.webview.get_snapshot(WebKit2.SnapshotRegion.VISIBLE, options, None, self._on_snapshot)
+        return GLib.SOURCE_REMOVE
+
+    def _on_snapshot(self, webview, result):
+        self.rendering = False
+        try:
+            surface = webview.get_snapshot_finish(result)
+        except GLib.Error as err:
+            warn(f"Could not take a snapshot, staying live: {err.message}")
+            return
+        alloc = webview.get_allocation()
+        path = self.path(alloc.width, alloc.height)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            surface.write_to_png(path)
+        except (OSError, IOError) as err:
+            warn(f"Could not write snapshot to {path}: {err}")
+            return
+        self._prune()
+        self._show(alloc.width, alloc.height)
+        self._drop_web_process()
+
+    def _show(self, width: int, height: int) -> bool:
+        path = self.path(width, height)
+        try:
+            surface = cairo.ImageSurface.create_from_png(path)
+            # Counts as recently used when the cache is pruned
+            os.utime(path)
+        except (OSError, IOError, cairo.Error):
+            return False
+        # The picture has scale * size pixels, drawn at the device scale it is as sharp as the page was
+        scale = self.wv.window.get_scale_factor()
+        surface.set_device_scale(scale, scale)
+        self.image.set_from_surface(surface)
+        self.size = (width, height)
+        self.stack.set_visible_child_name("snapshot")
+        return True
+
+    def _prune(self):
+        # Other widgets may share the directory and prune it at the same time
+        try:
+            entries = [(e.stat().st_mtime, e.path) for e in os.scandir(self.directory) if e.name.endswith(".png")]
+        except OSError:
+            return
+        entries.sort(reverse=True)
+        oldest = time.time() - MAX_AGE_S
+        for i, (mtime, path) in enumerate(entries):
+            if i >= MAX_CACHED or mtime < oldest:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _drop_web_process(self):
+        if not hasattr(self.wv.webview, "terminate_web_process"):
+            warn("Snapshot mode needs WebKit2GTK 2.34 to terminate the web process, it stays resident")
+            return
+        self.wv.webview.terminate_web_process()
+        # Nothing evaluated against the terminated page will come back
+        self.wv._drop_pending()
+        info("Showing a snapshot, terminated the web process")
+
+    def _on_size_allocate(self, stack, alloc):
+        if self.size is None and not self.rendering:
+            GLib.idle_add(self._on_resized)
+            return
+        if self.rendering or self.size == (alloc.width, alloc.height):
+            return
+        if self._resize is not None:
+            GLib.source_remove(self._resize)
+        self._resize = GLib.timeout_add(RESIZE_DEBOUNCE_MS, self._on_resized)
+
+    def _on_resized(self):
+        self._resize = None
+        alloc = self.stack.get_allocation()
+        if (alloc.width, alloc.height) != self.size and not self.rendering:
+            # Another size of the same page may already be cached
+            self.start(alloc.width, alloc.height)
+        return GLib.SOURCE_REMOVE
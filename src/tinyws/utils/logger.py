@@ -1,4 +1,8 @@
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
 
 # TODO: The logs are still ugly, need to improve!
 
@@ -19,24 +23,81 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + format + reset
     }
 
+    def __init__(self):
+        super().__init__()
+        # Built once, not per record
+        self._formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+        self._default = logging.Formatter(self.FORMATS[logging.INFO])
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
-    
+        return self._formatters.get(record.levelno, self._default).format(record)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread as they are, the message is only formatted there.
+
+    The stock QueueHandler formats on the calling (GTK) thread, log arguments must therefore not
+    be mutated after the call"""
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks have to be rendered while the frames still exist
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
 # create logger with 'spam_application'
 logger = logging.getLogger("tinyws")
 logger.setLevel(logging.DEBUG)
+logger.propagate = False
 
-# create console handler with a higher log level
+# The terminal (or journald) is written to from a background thread, a slow one can't stall the UI
 ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
 
 ch.setFormatter(CustomFormatter())
 
-logger.addHandler(ch)
+_queue = queue.SimpleQueue()
+listener = logging.handlers.QueueListener(_queue, ch, respect_handler_level=True)
+listener.start()
+# Flushes what is still queued on exit
+atexit.register(listener.stop)
 
-warn = logger.warn
+logger.addHandler(DeferredQueueHandler(_queue))
+
+warn = logger.warning
 error = logger.error
 info = logger.info
-exception = logger.exception
\ No newline at end of file
+debug = logger.debug
+critical = logger.critical
+exception = logger.exception
+
+
+class throttled:
+    """Wraps a log function for a hot call site, logging at most once per `interval` seconds and/or
+    one call in `every`, the number of dropped messages is appended to the next one that gets through
+
+        log_tick = throttled(info, interval=1.0)
+        log_tick("Tick %d", n)
+    """
+
+    def __init__(self, log, interval: float = 0, every: int = 1):
+        self.log = log
+        self.interval = interval
+        self.every = max(1, every)
+        self._calls = 0
+        self._dropped = 0
+        self._last = float("-inf")
+
+    def __call__(self, msg, *args):
+        self._calls += 1
+        now = time.monotonic()
+        if (self._calls - 1) % self.every or now - self._last < self.interval:
+            self._dropped += 1
+            return
+        self._last = now
+        if self._dropped:
+            msg += f" ({self._dropped} similar messages dropped)"
+            self._dropped = 0
+        self.log(msg, *args, stacklevel=2)